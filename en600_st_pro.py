@@ -1,34 +1,87 @@
 import streamlit as st
 import pandas as pd
-import edge_tts
 import asyncio
 import os
 import time
 from pathlib import Path
-import pygame
 import wave
-import soundfile as sf
-from PIL import Image
-import subprocess
 import numpy as np
 import traceback
 import json
 import base64
-from pydub import AudioSegment
 import io
-import librosa
-import psutil
-import gc
+import importlib
+import atexit
+import unicodedata
 import hashlib
+import threading
+import uuid
+import sys
+import argparse
+import random
+import pickle
+import copy
+import shutil
+import tracemalloc
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from functools import lru_cache
+from collections import OrderedDict, namedtuple
+try:
+    import fcntl  # 여러 프로세스/서버 간 합성 잠금 (Windows에는 없음)
+except ImportError:
+    fcntl = None
 
 ## streamlit run en600st/en600_st_app.py
 # 15개국 78개 음성, 영어 19개국 48개 음성
 
 # 기본 경로 설정
 SCRIPT_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
-SETTINGS_PATH = SCRIPT_DIR / 'base/en600s-settings.json'
+SETTINGS_PATH = SCRIPT_DIR / 'base/en600s-settings.json'  # 공용 설정 (명령줄 기본값, 새 사용자의 초기값)
+USER_SETTINGS_DIR = SCRIPT_DIR / 'base/settings'  # 사용자별 설정 파일 (<사용자 ID>.json)
+SETTINGS_SAVE_DEBOUNCE = 2.0  # 연속된 설정 변경을 모아 한 번에 기록할 대기 시간(초)
+USER_SETTINGS_RETENTION_DAYS = 180  # 이 기간 동안 사용하지 않은 사용자 설정 파일은 삭제
 EXCEL_PATH = SCRIPT_DIR / 'base/en600new.xlsx'
+SHEETS_SIDECAR_PATH = SCRIPT_DIR / 'base/en600new.sheets.pkl'  # 엑셀 변환 캐시 (빠른 시작용)
+SHEETS_SIDECAR_FORMAT = 'en600-sheets'
+SHEETS_SIDECAR_VERSION = 1
+SHEET_INDEX_PATH = SCRIPT_DIR / 'base/en600new.index.json'  # 시트별 행 수/언어 정보 (설정 화면용)
+SHEET_INDEX_FORMAT = 'en600-sheet-index'
+SHEET_INDEX_VERSION = 3
 TEMP_DIR = SCRIPT_DIR / 'temp'  # 임시 파일 저장 경로 추가
+STATIC_DIR = SCRIPT_DIR / 'static'  # Streamlit 정적 파일 경로 (server.enableStaticServing)
+STATIC_URL = 'app/static'
+# 재생 후에도 유지되는 TTS 캐시 (TEMP_DIR 삭제 대상 아님, URL로 재생)
+# 여러 서버가 같은 저장소를 쓰려면 EN600_CLIP_STORE에 공유 경로 지정 (STATIC_DIR 밖이면 base64로 재생)
+TTS_CACHE_DIR = Path(os.environ.get('EN600_CLIP_STORE', STATIC_DIR / 'tts'))
+# 캐시 인덱스/항목별 메타데이터/잠금 파일 경로 (정적 파일로 공개되지 않는 위치, 공유 저장소라면 EN600_CLIP_META도 공유 경로 지정)
+TTS_CACHE_META_DIR = Path(os.environ.get('EN600_CLIP_META', TEMP_DIR / 'tts-meta'))
+TTS_CACHE_INDEX_PATH = TTS_CACHE_META_DIR / 'index.json'
+TTS_CACHE_MAX_BYTES = 500 * 1024 * 1024  # 캐시 최대 용량 (500MB)
+TTS_CACHE_INDEX_FLUSH_INTERVAL = 5.0  # 캐시 적중/저장 시 인덱스 저장 최소 간격(초) - 항목별 메타데이터 파일이 원본
+TTS_CACHE_LOCK_POLL = 0.05  # 다른 프로세스가 같은 클립을 합성 중일 때 확인 간격(초)
+CLIP_HOT_TIER_MAX_BYTES = 64 * 1024 * 1024  # 최근 재생한 클립(원본+base64)을 메모리에 보관할 용량 (모든 세션 공유)
+PREFETCH_CONCURRENCY = 4  # 미리 생성 시 동시 합성 개수
+TTS_MAX_CONCURRENCY = 8  # 프로세스 전체(모든 세션) 동시 합성 개수
+TTS_VOICE_MIN_INTERVAL = 0.05  # 같은 음성 요청 사이 최소 간격(초)
+TTS_MAX_RETRIES = 3  # 합성 실패 시 재시도 횟수
+TTS_BACKOFF_BASE = 0.5  # 재시도 대기 시작값(초), 시도마다 2배
+TTS_BACKOFF_MAX = 8.0  # 재시도 대기 최대값(초)
+TTS_BACKEND = os.environ.get('EN600_TTS_BACKEND', 'edge')  # 음성 합성 엔진 ('edge', 'local', 'fake')
+TTS_FALLBACK_BACKEND = os.environ.get('EN600_TTS_FALLBACK', 'local')  # 합성 실패 시 대체 엔진 ('none': 사용 안 함)
+LOCAL_TTS_COMMAND = os.environ.get('EN600_LOCAL_TTS', 'espeak-ng')  # 오프라인 TTS 실행 파일 (espeak-ng 호환)
+LOCAL_TTS_WPM = 175  # 오프라인 엔진의 1배속 분당 단어 수
+FAKE_TTS_LATENCY = float(os.environ.get('EN600_FAKE_TTS_LATENCY', 0))  # 테스트 엔진의 인위적 지연(초)
+PLAYBACK_TIMELINE_LIMIT = 500  # 세션에 보관할 재생 이벤트 수
+# 측정값을 Prometheus 텍스트 형식으로 주기적으로 기록할 파일 (STATIC_DIR 안이면 app/static/... URL로 조회 가능)
+METRICS_FILE = os.environ.get('EN600_METRICS_FILE')
+METRICS_FILE_INTERVAL = 15.0  # 측정값 파일 기록 간격(초)
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # 소요 시간 구간(초)
+# 처음 사용할 때 불러오는 무거운 모듈 (streamlit 첫 화면 로딩 시간을 줄이기 위해 지연)
+LAZY_MODULES = ('edge_tts', 'pydub', 'psutil')
+IMPORT_BUDGET_MS = 2500  # import-budget 명령의 기본 허용 시간(ms, 모듈 import 전체)
+TRACK_FRAME_RATE = 24000  # 문장 트랙 샘플레이트 (edge-tts 출력과 동일)
 
 # base 폴더가 없으면 생성
 if not (SCRIPT_DIR / 'base').exists():
@@ -230,6 +283,33 @@ LANGUAGE_MAPPING = {
     'hi': {'code': 'hi-IN', 'name': '인도'}  # 히브리어(인도) 추가
 }
 
+# 엑셀 열 이름 매핑
+COLUMN_MAPPING = {
+    'english': 'en-미국',
+    'korean': 'ko-한국',
+    'chinese': 'zh-중국',
+    'japanese': 'ja-일본',
+    'vietnamese': 'vi-베트남',
+    'thai': 'th-태국',
+    'filipino': 'tl-필리핀',
+    'russian': 'ru-러시아',
+    'uzbek': 'uz-우즈벡',
+    'mongolian': 'mn-몽골',
+    'nepali': 'ne-네팔',
+    'burmese': 'my-미얀마',
+    'indonesian': 'id-인니',
+    'khmer': 'km-캄보디아',
+    'hindi': 'hi-인도'
+}
+
+# 알림음 파일
+BREAK_SOUND_PATH = SCRIPT_DIR / 'base/break.wav'
+FINAL_SOUND_PATH = SCRIPT_DIR / 'base/final.wav'
+
+# 브레이크 안내 음성
+BREAK_MESSAGE = "쉬어가는 시간입니다, 5초간의 호흡을 느껴보세요"
+BREAK_VOICE = VOICE_MAPPING['korean']['선희']
+
 def format_column_header(lang_code):
     """
     언어 코드를 기반으로 '[코드]-[국가명]' 형식의 컬럼 헤더를 반환합니다.
@@ -238,154 +318,389 @@ def format_column_header(lang_code):
         return f"{lang_code}-{LANGUAGE_MAPPING[lang_code]['name']}"
     return lang_code
 
+def _workbook_signature(path=EXCEL_PATH):
+    """엑셀 파일의 (수정 시각, 크기) - 캐시 키로 사용"""
+    stat = Path(path).stat()
+    return stat.st_mtime_ns, stat.st_size
+
+def _parse_workbook(path_str):
+    """openpyxl로 엑셀 전체 시트 읽기 (느림)"""
+    with timing_span('excel_read'):
+        sheets = pd.read_excel(path_str, sheet_name=None, header=0, engine='openpyxl')
+    compact = {}
+    for name, df in sheets.items():
+        # 내용이 없는 'Unnamed' 열 제거
+        keep = [col for col in df.columns if not str(col).startswith('Unnamed') or df[col].notna().any()]
+        compact[name] = df[keep]
+    return {'sheet_names': list(sheets.keys()), 'sheets': compact}
+
+def _sidecar_header(mtime_ns, size):
+    """변환 캐시 파일 헤더 (형식/버전/원본 정보)"""
+    return {
+        'format': SHEETS_SIDECAR_FORMAT,
+        'version': SHEETS_SIDECAR_VERSION,
+        'source': EXCEL_PATH.name,
+        'source_mtime_ns': mtime_ns,
+        'source_size': size
+    }
+
+def load_sheets_sidecar(mtime_ns, size, sidecar_path=SHEETS_SIDECAR_PATH):
+    """변환 캐시가 엑셀보다 새롭고 헤더가 일치하면 로드, 아니면 None"""
+    try:
+        if not sidecar_path.exists() or sidecar_path.stat().st_mtime_ns < mtime_ns:
+            return None
+        with open(sidecar_path, 'rb') as f, timing_span('sidecar_load'):
+            header = pickle.load(f)
+            if header != _sidecar_header(mtime_ns, size):
+                return None
+            return pickle.load(f)
+    except Exception:
+        traceback.print_exc()
+        return None
+
+def write_sheets_sidecar(workbook, mtime_ns, size, sidecar_path=SHEETS_SIDECAR_PATH):
+    """워크북을 변환 캐시 파일로 저장 (헤더 + 데이터, 임시 파일 후 이름 변경)"""
+    tmp_path = sidecar_path.with_name(f"{sidecar_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(_sidecar_header(mtime_ns, size), f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(workbook, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, sidecar_path)
+        return True
+    except Exception:
+        traceback.print_exc()
+        return False
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _load_workbook(path_str, mtime_ns, size):
+    """엑셀 전체 시트를 한 번만 읽어 모든 세션이 공유 (파일이 바뀌면 키가 달라져 다시 읽음)"""
+    # 변환 캐시가 유효하면 openpyxl 파싱 생략
+    workbook = load_sheets_sidecar(mtime_ns, size)
+    if workbook is None:
+        workbook = _parse_workbook(path_str)
+        write_sheets_sidecar(workbook, mtime_ns, size)
+    return workbook
+
+def get_workbook():
+    """캐시된 엑셀 워크북 ({'sheet_names': [...], 'sheets': {이름: DataFrame}}) - 읽기 전용으로 사용"""
+    return _load_workbook(str(EXCEL_PATH), *_workbook_signature())
+
+def get_sheet_names():
+    """엑셀 시트 이름 목록"""
+    return get_workbook()['sheet_names']
+
+def build_sheet_index(workbook):
+    """시트별 행 수, 열 목록, 언어별 내용 있는 행 수와 글자 수 요약"""
+    sheets = {}
+    for name in workbook['sheet_names']:
+        df = workbook['sheets'][name]
+        languages = {}
+        for lang, col in COLUMN_MAPPING.items():
+            if col not in df.columns:
+                continue
+            lengths = [len(text) for text in map(normalize_text, df[col].tolist()) if text]
+            if lengths:
+                languages[lang] = {'count': len(lengths), 'chars': sum(lengths), 'max_chars': max(lengths)}
+        sheets[name] = {'rows': len(df), 'columns': [str(col) for col in df.columns], 'languages': languages}
+    return {'sheet_names': list(workbook['sheet_names']), 'sheets': sheets}
+
+def _sheet_index_header(mtime_ns, size):
+    """시트 정보 파일 헤더 (형식/버전/원본 정보)"""
+    return dict(_sidecar_header(mtime_ns, size), format=SHEET_INDEX_FORMAT, version=SHEET_INDEX_VERSION)
+
+def load_sheet_index_file(mtime_ns, size, index_path=SHEET_INDEX_PATH):
+    """시트 정보 파일의 헤더가 현재 엑셀과 일치하면 로드, 아니면 None"""
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('header') != _sheet_index_header(mtime_ns, size):
+            return None
+        return data['index']
+    except Exception:
+        return None
+
+def write_sheet_index_file(index, mtime_ns, size, index_path=SHEET_INDEX_PATH):
+    """시트 정보를 파일로 저장 (임시 파일 후 이름 변경)"""
+    tmp_path = index_path.with_name(f"{index_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'header': _sheet_index_header(mtime_ns, size), 'index': index}, f, ensure_ascii=False)
+        os.replace(tmp_path, index_path)
+        return True
+    except Exception:
+        traceback.print_exc()
+        return False
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _load_sheet_index(path_str, mtime_ns, size):
+    """시트 정보를 엑셀 버전당 한 번만 만들어 모든 세션이 공유 (파일이 있으면 워크북을 읽지 않음)"""
+    index = load_sheet_index_file(mtime_ns, size)
+    if index is None:
+        index = build_sheet_index(_load_workbook(path_str, mtime_ns, size))
+        write_sheet_index_file(index, mtime_ns, size)
+    return index
+
+def get_sheet_index():
+    """캐시된 시트 정보 ({'sheet_names': [...], 'sheets': {이름: {'rows', 'columns', 'languages'}}})"""
+    return _load_sheet_index(str(EXCEL_PATH), *_workbook_signature())
+
+def sheet_languages(sheet):
+    """시트에 내용이 있는 언어 목록 (COLUMN_MAPPING 순서)"""
+    index = get_sheet_index()
+    if isinstance(sheet, int):
+        sheet = index['sheet_names'][sheet]
+    available = index['sheets'][sheet]['languages']
+    return [lang for lang in COLUMN_MAPPING if lang in available]
+
+def get_sheet(sheet=0):
+    """시트 이름 또는 번호로 캐시된 DataFrame 반환 (공유 객체이므로 수정 금지)"""
+    workbook = get_workbook()
+    if isinstance(sheet, int):
+        sheet = workbook['sheet_names'][sheet]
+    return workbook['sheets'][sheet]
+
+def project_sheet_columns(df, columns, start_idx, end_idx):
+    """DataFrame에서 필요한 열과 행 범위만 리스트로 추출 {열 이름: [값...]} (없는 열은 빈 문자열)"""
+    end_idx = min(end_idx, len(df) - 1)
+    count = max(0, end_idx - start_idx + 1)
+    present = [col for col in dict.fromkeys(columns) if col in df.columns]
+    block = df.iloc[start_idx:start_idx + count][present] if present else None
+    return {col: block[col].tolist() if col in present else [""] * count for col in columns}
+
+def cell_text(value):
+    """셀 값을 자막/합성에 쓰는 문자열로 변환 (원문 유지) - 빈 셀(NaN/None)은 ''(무음)"""
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    return value if isinstance(value, str) else str(value)
+
+@lru_cache(maxsize=65536)
+def _normalize_str(text):
+    """문자열 정규화 (NFC, BOM 제거, NBSP 포함 연속 공백을 한 칸으로)"""
+    text = unicodedata.normalize('NFC', text).replace('\ufeff', '')
+    return ' '.join(text.split())
+
+def normalize_text(value):
+    """캐시 키/중복 판단에 쓰는 표준 문자열 - 빈 셀(NaN/None/공백)은 ''
+
+    앞뒤/연속 공백만 통일하고 문자 자체는 바꾸지 않음 (전각 문장부호, 폭 없는 공백/결합 문자는 문자 체계의 일부)
+    """
+    return _normalize_str(cell_text(value))
+
+def load_sheet_range(sheet, languages, start_idx, end_idx):
+    """선택한 언어 열과 행 범위만 로드 {언어: [문장...]} - 세션 메모리는 학습 범위만큼만 사용"""
+    columns = {lang: COLUMN_MAPPING[lang] for lang in dict.fromkeys(languages) if lang in COLUMN_MAPPING}
+    data = project_sheet_columns(get_sheet(sheet), list(columns.values()), start_idx, end_idx)
+    return {lang: [cell_text(value) for value in data[col]] for lang, col in columns.items()}
+
+def build_text_dedup_index(workbook, languages=None):
+    """시트 전체의 언어별 정규화 문장 -> {'text': 처음 나온 원문, 'rows': [(시트, 행 번호)...]}
+
+    여러 시트에 반복되는 문장은 한 번만 합성
+    """
+    index = {}
+    for lang, col in COLUMN_MAPPING.items():
+        if languages and lang not in languages:
+            continue
+        occurrences = {}
+        for name in workbook['sheet_names']:
+            df = workbook['sheets'][name]
+            if col not in df.columns:
+                continue
+            for row, value in enumerate(df[col].tolist(), start=1):
+                text = normalize_text(value)
+                if text:
+                    occurrences.setdefault(text, {'text': cell_text(value), 'rows': []})['rows'].append((name, row))
+        if occurrences:
+            index[lang] = occurrences
+    return index
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _load_text_dedup_index(path_str, mtime_ns, size):
+    """문장 중복 인덱스를 엑셀 버전당 한 번만 생성"""
+    return build_text_dedup_index(_load_workbook(path_str, mtime_ns, size))
+
+def get_text_dedup_index():
+    """캐시된 문장 중복 인덱스 {언어: {정규화 문장: {'text', 'rows'}}} - 읽기 전용으로 사용"""
+    return _load_text_dedup_index(str(EXCEL_PATH), *_workbook_signature())
+
+def text_dedup_stats(index):
+    """언어별 전체 문장 수/고유 문장 수 {언어: {'cells', 'unique'}}"""
+    return {lang: {'cells': sum(len(item['rows']) for item in texts.values()), 'unique': len(texts)}
+            for lang, texts in index.items()}
+
+# 기본 설정값 정의
+DEFAULT_SETTINGS = {
+    # 언어 기본값
+    'first_lang': 'korean',   # 1순위 한국어
+    'second_lang': 'english', # 2순위 영어
+    'third_lang': 'english',  # 3순위 영어
+    
+    # 재생 횟수 기본값
+    'first_repeat': 1,   # 1순위 1회
+    'second_repeat': 1,  # 2순위 1회
+    'third_repeat': 1,   # 3순위 1회
+    
+    # 언어별 배속 기본값
+    'first_korean_speed': 1.5,  # 1순위 한국어 1.5배속
+    'second_english_speed': 2.0, # 2순위 영어 2배속
+    'third_english_speed': 3.0,  # 3순위 영어 3배속
+    
+    # 음성 설정
+    'eng_voice': 'Steffan (US)',
+    'kor_voice': '선희',
+    'zh_voice': '샤오샤오',
+    'jp_voice': 'Nanami',
+    'vi_voice': 'HoaiMy',
+    'third_english_voice': 'Jenny (US)',  # 3순위 영어 음성 Jenny로 설정
+    
+    # 학습 범위 설정
+    'start_row': 1,  # 시작 행
+    'end_row': 20,   # 종료 행
+    
+    # 기타 설정
+    'spacing': 1.0,
+    'subtitle_delay': 1.0,
+    'next_sentence_time': 1.0,
+    'break_enabled': True,
+    'break_interval': 10,
+    'break_duration': 5,
+    'keep_subtitles': True,
+    'hide_subtitles': {
+        'first_lang': False,
+        'second_lang': False,
+        'third_lang': False
+    },
+    
+    # 폰트 설정
+    'first_font_size': 32,
+    'second_font_size': 32,
+    'third_font_size': 32,
+    'first_color': '#00FF00',  # 초록색
+    'second_color': '#FFFFF0', # 아이보리
+    'third_color': '#00FF00',  # 초록색
+    
+    # 오디오 설정
+    'audio_playback_method': 'html5',
+    'audio_wait_mode': 'duration',
+    'fixed_wait_time': 2.0,
+
+    # 미리 생성 설정 (현재 문장 재생 중 다음 N문장 음성 합성)
+    'prefetch_depth': 3,
+
+    # 재생 방식 ('clips': 클립별 재생, 'sentence': 문장 단위 트랙)
+    'audio_track_mode': 'clips',
+
+    # 자막 단어 강조 (클립 재생 시 단어 경계 시각에 맞춰 표시)
+    'subtitle_word_sync': False,
+
+    # 진단 정보 표시 (설정 화면 하단에 구간별 소요 시간/자원 사용량)
+    'show_diagnostics': False
+}
+
+@st.cache_resource(show_spinner=False)
+def initialize_process():
+    """프로세스당 한 번만 필요한 준비 작업 (temp 폴더, 사용자 설정 정리, 브레이크 알림음) - 모든 세션 공유
+
+    실패하면 예외가 그대로 전달되어 캐시되지 않으므로 다음 세션에서 다시 시도
+    """
+    # temp 폴더가 없으면 생성
+    TEMP_DIR.mkdir(parents=True, exist_ok=True)
+
+    # 오래 사용하지 않은 사용자 설정 정리
+    cleanup_user_settings()
+
+    # break.wav 파일이 없으면 기본 알림음 생성 (북소리)
+    if not BREAK_SOUND_PATH.exists():
+        # get_voice_file은 오류를 삼키므로 직접 합성하여 실패가 캐시되지 않도록 함
+        asyncio.run(_render_to_file(get_tts_backend(), "딩동", "ko-KR-SunHiNeural", speed_to_rate(1.0), BREAK_SOUND_PATH))
+    return True
+
+def load_today_study_time(current_date):
+    """학습 시간 파일에서 오늘 누적 학습 시간(분) 로드"""
+    try:
+        with open(SCRIPT_DIR / 'study_time.json', 'r') as f:
+            study_data = json.load(f)
+        return study_data.get('time', 0) if study_data.get('date') == current_date else 0
+    except Exception:
+        return 0
+
 def initialize_session_state():
-    """세션 상태 초기화 함수"""
+    """세션 상태 초기화 함수 (파일 읽기/쓰기는 세션 시작 시 한 번만)"""
+    # 재생 구간 학습 시간은 매 실행마다 현재 시각부터 계산
+    st.session_state.last_update_time = time.time()
+
+    # 날짜가 바뀌면 오늘 학습 시간 초기화
+    current_date = time.strftime('%Y-%m-%d')
+    if st.session_state.get('today_date', current_date) != current_date:
+        st.session_state.today_total_study_time = 0
+        st.session_state.today_date = current_date
+
+    if st.session_state.get('session_initialized'):
+        return
+
     # 페이지 상태 초기화
     if 'page' not in st.session_state:
         st.session_state.page = 'settings'
     
-    # 기본 설정값 정의
-    default_settings = {
-        # 언어 기본값
-        'first_lang': 'korean',   # 1순위 한국어
-        'second_lang': 'english', # 2순위 영어
-        'third_lang': 'english',  # 3순위 영어
-        
-        # 재생 횟수 기본값
-        'first_repeat': 1,   # 1순위 1회
-        'second_repeat': 1,  # 2순위 1회
-        'third_repeat': 1,   # 3순위 1회
-        
-        # 언어별 배속 기본값
-        'first_korean_speed': 1.5,  # 1순위 한국어 1.5배속
-        'second_english_speed': 2.0, # 2순위 영어 2배속
-        'third_english_speed': 3.0,  # 3순위 영어 3배속
-        
-        # 음성 설정
-        'eng_voice': 'Steffan (US)',
-        'kor_voice': '선희',
-        'zh_voice': '샤오샤오',
-        'jp_voice': 'Nanami',
-        'vi_voice': 'HoaiMy',
-        'third_english_voice': 'Jenny (US)',  # 3순위 영어 음성 Jenny로 설정
-        
-        # 학습 범위 설정
-        'start_row': 1,  # 시작 행
-        'end_row': 20,   # 종료 행
-        
-        # 기타 설정
-        'spacing': 1.0,
-        'subtitle_delay': 1.0,
-        'next_sentence_time': 1.0,
-        'break_enabled': True,
-        'break_interval': 10,
-        'break_duration': 5,
-        'keep_subtitles': True,
-        'hide_subtitles': {
-            'first_lang': False,
-            'second_lang': False,
-            'third_lang': False
-        },
-        
-        # 폰트 설정
-        'first_font_size': 32,
-        'second_font_size': 32,
-        'third_font_size': 32,
-        'first_color': '#00FF00',  # 초록색
-        'second_color': '#FFFFF0', # 아이보리
-        'third_color': '#00FF00',  # 초록색
-        
-        # 오디오 설정
-        'audio_playback_method': 'html5',
-        'audio_wait_mode': 'duration',
-        'fixed_wait_time': 2.0
-    }
-    
-    # 설정이 없는 경우 기본값으로 초기화
+    # 설정이 없는 경우 사용자 설정 파일에서 로드 (세션당 한 번)
+    user_id = settings_user_id()
     if 'settings' not in st.session_state:
-        st.session_state.settings = default_settings
+        st.session_state.settings = load_saved_settings(user_id)
+        if user_id:
+            try:
+                # 사용 중인 설정 파일은 보관 기간 정리 대상에서 제외되도록 사용 시각 갱신
+                os.utime(user_settings_path(user_id))
+            except OSError:
+                pass
     else:
         # 기존 설정에 누락된 값이 있으면 기본값으로 보완
-        for key, value in default_settings.items():
+        for key, value in copy.deepcopy(DEFAULT_SETTINGS).items():
             if key not in st.session_state.settings:
                 st.session_state.settings[key] = value
-        
-        # 영어 음성 이름 업데이트
-        voice_mapping_old_to_new = {
-            'Steffan': 'Steffan (US)',
-            'Roger': 'Roger (US)',
-            'Sonia': 'Sonia (GB)',
-            'Brian': 'Brian (US)',
-            'Emma': 'Emma (US)',
-            'Jenny': 'Jenny (US)',
-            'Guy': 'Guy (US)',
-            'Aria': 'Aria (US)',
-            'Ryan': 'Ryan (GB)'
-        }
-        
-        # 각 언어 순위별 음성 설정 업데이트
-        for rank in ['first', 'second', 'third']:
-            lang = st.session_state.settings.get(f'{rank}_lang')
-            if lang == 'english':
-                voice_key = f'{rank}_english_voice'
-                old_voice = st.session_state.settings.get(voice_key)
-                if old_voice in voice_mapping_old_to_new:
-                    st.session_state.settings[voice_key] = voice_mapping_old_to_new[old_voice]
+
+    # 영어 음성 이름 업데이트
+    voice_mapping_old_to_new = {
+        'Steffan': 'Steffan (US)',
+        'Roger': 'Roger (US)',
+        'Sonia': 'Sonia (GB)',
+        'Brian': 'Brian (US)',
+        'Emma': 'Emma (US)',
+        'Jenny': 'Jenny (US)',
+        'Guy': 'Guy (US)',
+        'Aria': 'Aria (US)',
+        'Ryan': 'Ryan (GB)'
+    }
+    
+    # 각 언어 순위별 음성 설정 업데이트
+    for rank in ['first', 'second', 'third']:
+        lang = st.session_state.settings.get(f'{rank}_lang')
+        if lang == 'english':
+            voice_key = f'{rank}_english_voice'
+            old_voice = st.session_state.settings.get(voice_key)
+            if old_voice in voice_mapping_old_to_new:
+                st.session_state.settings[voice_key] = voice_mapping_old_to_new[old_voice]
 
     # 학습 시간 관련 변수 초기화
     if 'start_time' not in st.session_state:
         st.session_state.start_time = time.time()
-    
-    # 오늘 날짜 확인
-    current_date = time.strftime('%Y-%m-%d')
-    
-    # 학습 시간 파일 경로
-    study_time_path = SCRIPT_DIR / 'study_time.json'
-    
-    # 파일에서 학습 시간 데이터 로드
-    try:
-        if study_time_path.exists():
-            with open(study_time_path, 'r') as f:
-                study_data = json.load(f)
-                if study_data.get('date') == current_date:
-                    st.session_state.today_total_study_time = study_data.get('time', 0)
-                else:
-                    st.session_state.today_total_study_time = 0
-        else:
-            st.session_state.today_total_study_time = 0
-    except Exception:
-        st.session_state.today_total_study_time = 0
-    
+    st.session_state.today_total_study_time = load_today_study_time(current_date)
     st.session_state.today_date = current_date
-    st.session_state.last_update_time = time.time()
-
-    # 다크 모드 감지
-    is_dark_mode = st.get_option("theme.base") == "dark"
-    
-    # temp 폴더가 없으면 생성
-    if not TEMP_DIR.exists():
-        TEMP_DIR.mkdir(parents=True)
-    
-    # break.wav 파일 존재 여부 확인
-    break_sound_path = SCRIPT_DIR / './base/break.wav'
-    if not break_sound_path.exists():
-        st.warning("브레이크 알림음 파일이 없습니다. 기본 알림음을 생성합니다.")
-        try:
-            # 기본 알림음 생성 (북소리)
-            communicate = edge_tts.Communicate("딩동", "ko-KR-SunHiNeural")
-            asyncio.run(communicate.save(str(break_sound_path)))
-        except Exception as e:
-            st.error(f"알림음 생성 오류: {e}")
 
     # 베트남어 음성 설정 확실히 초기화
     if 'vi_voice' not in st.session_state.settings:
         st.session_state.settings['vi_voice'] = 'HoaiMy'
-    
-    # 설정 저장
-    save_settings(st.session_state.settings)
 
-    # pygame 초기화
-    initialize_pygame_mixer()
+    try:
+        initialize_process()
+    except Exception as e:
+        # 완료 표시를 하지 않아 다음 실행에서 다시 시도
+        st.error(f"알림음 생성 오류: {e}")
+    else:
+        st.session_state.session_initialized = True
 
 def create_settings_ui(return_to_learning=False):
     """설정 화면 UI 생성"""
@@ -505,9 +820,9 @@ def create_settings_ui(return_to_learning=False):
         with col2:
             # 엑셀 파일에서 시트 선택 및 최대 행 수 가져오기
             try:
-                # 엑셀 파일 전체 읽기
-                excel_file = pd.ExcelFile(EXCEL_PATH)
-                sheet_names = excel_file.sheet_names[:6]  # 처음 6개의 시트만 사용
+                # 시트 정보 (엑셀 버전당 한 번 만든 요약, 워크북 전체를 읽지 않음)
+                sheet_index = get_sheet_index()
+                sheet_names = sheet_index['sheet_names'][:6]  # 처음 6개의 시트만 사용
                 
                 # 시트 선택 (기본값: 첫 번째 시트)
                 selected_sheet = st.selectbox(
@@ -518,29 +833,21 @@ def create_settings_ui(return_to_learning=False):
                     label_visibility="visible"
                 )
                 
-                # 선택된 시트 데이터 읽기
-                df = pd.read_excel(
-                    EXCEL_PATH,
-                    sheet_name=selected_sheet,
-                    header=0,
-                    engine='openpyxl'
-                )
-                max_row = len(df)
+                # 선택된 시트의 행 수
+                max_row = sheet_index['sheets'][selected_sheet]['rows']
                 
                 # 선택된 시트 정보를 설정에 저장
                 settings['selected_sheet'] = selected_sheet
                 
-                # 4번째 시트부터는 5개 언어만 있음을 처리
-                sheet_index = sheet_names.index(selected_sheet)
-                if sheet_index >= 3:  # 0-based index이므로 3부터가 4번째 시트
-                    # 5개 언어만 사용 가능하도록 제한
-                    supported_languages = ['korean', 'english', 'chinese', 'japanese', 'vietnamese']
-                    # 현재 선택된 언어들이 지원되는지 확인하고 필요시 조정
-                    for rank in ['first', 'second', 'third']:
-                        lang_key = f'{rank}_lang'
-                        if settings[lang_key] not in supported_languages and settings[lang_key] != 'none':
-                            settings[lang_key] = 'english'  # 기본값으로 영어 설정
-                            st.warning(f"4번째 시트부터는 한국어, 영어, 중국어, 일본어, 베트남어만 지원됩니다. {rank} 언어가 영어로 재설정되었습니다.")
+                # 시트에 내용이 있는 언어만 사용 가능
+                available_languages = sheet_languages(selected_sheet)
+                fallback_lang = 'english' if 'english' in available_languages else available_languages[0]
+                for rank in ['first', 'second', 'third']:
+                    lang_key = f'{rank}_lang'
+                    if settings[lang_key] not in available_languages and settings[lang_key] != 'none':
+                        settings[lang_key] = fallback_lang
+                        available_text = ', '.join(LANG_DISPLAY.get(lang, lang) for lang in available_languages)
+                        st.warning(f"이 시트는 {available_text}만 지원됩니다. {rank} 언어가 {LANG_DISPLAY.get(fallback_lang, fallback_lang)}(으)로 재설정되었습니다.")
                 
             except Exception as e:
                 st.error(f"엑셀 파일 읽기 오류: {e}")
@@ -549,6 +856,7 @@ def create_settings_ui(return_to_learning=False):
             # 학습 시작 버튼 추가 (이전 위치)
             if st.button("▶️ 학습 시작", use_container_width=True, key="start_btn_top"):
                 save_settings(settings)
+                st.session_state.pop('lesson_position', None)  # 설정 화면에서 시작하면 처음부터
                 st.session_state.page = 'learning'
                 st.rerun()
 
@@ -627,6 +935,8 @@ def create_settings_ui(return_to_learning=False):
             'filipino', 'thai', 'russian', 'uzbek', 'mongolian', 
             'nepali', 'burmese', 'indonesian', 'khmer', 'hindi'  # 힌디어 추가
         ]
+        # 선택한 시트에 있는 언어만 표시
+        supported_languages = [lang for lang in supported_languages if lang in available_languages]
         
         with col1:
             st.markdown('<div style="color: #FF0000;">1번째 언어</div>', unsafe_allow_html=True)
@@ -759,6 +1069,7 @@ def create_settings_ui(return_to_learning=False):
         # 학습 시작 버튼 추가 (자막|음성|속도 섹션 아래)
         if st.button("▶️ 학습 시작", use_container_width=True, key="start_btn_middle"):
             save_settings(settings)
+            st.session_state.pop('lesson_position', None)  # 설정 화면에서 시작하면 처음부터
             st.session_state.page = 'learning'
             st.rerun()
 
@@ -817,7 +1128,7 @@ def create_settings_ui(return_to_learning=False):
 
         # 학습 설정 추가
         st.subheader("✅ 학습 설정")
-        col1, col2, col3 = st.columns(3)
+        col1, col2, col3, col4 = st.columns(4)
         
         with col1:
             # 자동 반복 설정
@@ -869,9 +1180,46 @@ def create_settings_ui(return_to_learning=False):
             settings['final_sound_enabled'] = selected_duration != '없음'
             settings['final_sound_duration'] = final_sound_mapping[selected_duration]
 
+        with col4:
+            # 미리 생성 문장 수 설정
+            prefetch_options = [0, 1, 2, 3, 5, 10]
+            current_prefetch = settings.get('prefetch_depth', 3)
+            if current_prefetch not in prefetch_options:
+                current_prefetch = 3  # 기본값
+            settings['prefetch_depth'] = st.selectbox(
+                "미리 생성(문장)",
+                options=prefetch_options,
+                index=prefetch_options.index(current_prefetch),
+                key="prefetch_depth_main"
+            )
+
+            # 재생 방식 (문장 단위 트랙은 ffmpeg 필요)
+            track_modes = {'clips': '클립별 재생', 'sentence': '문장 단위 트랙'}
+            current_mode = settings.get('audio_track_mode', 'clips')
+            if current_mode not in track_modes:
+                current_mode = 'clips'  # 기본값
+            settings['audio_track_mode'] = st.selectbox(
+                "재생 방식",
+                options=list(track_modes.keys()),
+                index=list(track_modes.keys()).index(current_mode),
+                format_func=lambda x: track_modes[x],
+                key="audio_track_mode_main"
+            )
+            settings['subtitle_word_sync'] = st.checkbox(
+                "자막 단어 강조",
+                value=settings.get('subtitle_word_sync', False),
+                key="subtitle_word_sync_main"
+            )
+            settings['show_diagnostics'] = st.checkbox(
+                "진단 정보 표시",
+                value=settings.get('show_diagnostics', False),
+                key="show_diagnostics_main"
+            )
+
         # 학습 시작 버튼 위치 이동 (학습 설정 아래, 폰트 설정 위)
         if st.button("▶️ 학습 시작", use_container_width=True, key="start_btn_bottom"):
             save_settings(settings)
+            st.session_state.pop('lesson_position', None)  # 설정 화면에서 시작하면 처음부터
             st.session_state.page = 'learning'
             st.rerun()
 
@@ -924,13 +1272,44 @@ def create_settings_ui(return_to_learning=False):
                                          key="third_color_select")
             settings['third_color'] = COLOR_MAPPING[selected_color]
 
+        if settings.get('show_diagnostics', False):
+            create_diagnostics_panel()
+
+def create_diagnostics_panel():
+    """진단 정보 - 구간별 소요 시간, 캐시/합성 통계, 프로세스 자원 사용량"""
+    with st.expander("🔧 진단 정보", expanded=True):
+        spans = get_span_metrics()
+        if spans:
+            st.dataframe(pd.DataFrame.from_dict(spans, orient='index'), use_container_width=True)
+        else:
+            st.caption("아직 측정된 구간이 없습니다.")
+
+        process = sample_process_metrics()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("메모리(RSS)", f"{process['rss_bytes'] / 1024 / 1024:.0f} MB")
+        col2.metric("CPU", f"{process['cpu_percent']:.0f}%")
+        col3.metric("스레드", process['threads'])
+
+        cache = get_tts_cache_stats()
+        hot = get_clip_hot_tier_stats()
+        lookups = cache['hits'] + cache['misses']
+        st.caption(
+            f"TTS 캐시: {cache['entries']}개 {cache['bytes'] / 1024 / 1024:.1f}MB, "
+            f"적중률 {cache['hits'] / lookups if lookups else 0:.0%} ({cache['hits']}/{lookups}) | "
+            f"메모리 보관: {hot['entries']}개 {hot['bytes'] / 1024 / 1024:.1f}MB | "
+            f"합성 요청 {TTS_CLIENT_STATS['requests']} (병합 {TTS_CLIENT_STATS['coalesced']}, "
+            f"재시도 {TTS_CLIENT_STATS['retries']}, 대체 {TTS_CLIENT_STATS['fallbacks']})"
+        )
+        st.download_button("측정값 내려받기 (Prometheus)", format_prometheus_metrics(),
+                           file_name="en600-metrics.prom", mime="text/plain", key="metrics_download")
+
 def get_voice_mapping(language, voice_setting):
     """안전하게 음성 매핑을 가져오는 함수"""
     try:
         # 기본값 설정
         default_voices = {
             'korean': '선희',
-            'english': 'Steffan',
+            'english': 'Steffan (US)',
             'chinese': '샤오샤오',
             'japanese': 'Nanami',
             'vietnamese': 'HoaiMy',
@@ -965,29 +1344,35 @@ def get_voice_mapping(language, voice_setting):
         st.error(f"음성 매핑 오류 ({language}): {str(e)}")
         return None
 
-def initialize_pygame_mixer():
-    """pygame mixer 초기화 함수"""
+def audio_mime_type(audio_bytes):
+    """오디오 데이터의 MIME 형식 (형식이 기록되지 않은 이전 캐시 항목은 확장자와 내용이 다를 수 있어 내용으로 판단)"""
+    return 'audio/wav' if audio_bytes[:4] == b'RIFF' else 'audio/mpeg'
+
+def get_audio_url(file_path):
+    """정적 파일 경로 안의 오디오는 URL 반환, 정적 서빙이 꺼져 있거나 경로 밖이면 None"""
     try:
-        # 기본 오디오 초기화
-        pygame.mixer.init()
+        if not st.get_option('server.enableStaticServing'):
+            return None
+        relative = Path(file_path).resolve().relative_to(STATIC_DIR.resolve())
     except Exception:
-        try:
-            # 대체 설정으로 초기화 시도
-            pygame.mixer.init(44100, -16, 2, 2048)
-        except Exception:
-            try:
-                # SDL 오디오 드라이버 변경 시도
-                os.environ['SDL_AUDIODRIVER'] = 'dummy'
-                pygame.mixer.init(44100, -16, 2, 2048)
-            except Exception as e:
-                st.warning(f"오디오 시스템 초기화 실패: {str(e)}")
-                return False
-    return True
-
-def play_audio(file_path, sentence_interval=1.0, next_sentence=False):
+        return None
+    return f"{STATIC_URL}/{relative.as_posix()}"
+
+def clip_wait_time(duration, sentence_interval, next_sentence, settings):
+    """클립 재생 시작부터 다음 재생까지의 대기 시간(초)"""
+    if settings.get('audio_wait_mode', 'duration') == 'fixed':
+        return settings.get('fixed_wait_time', 2.0)
+    if next_sentence:
+        return duration + 0.3
+    extra_wait = duration * 0.1 if duration > 5 else 0.5
+    return max(duration + extra_wait + sentence_interval, duration + 0.3)
+
+def play_audio(file_path, sentence_interval=1.0, next_sentence=False, wait=True):
     """
     음성 파일 재생 - 저장된 설정에 따라 재생 방식 선택
+    wait=False이면 대기하지 않고 필요한 대기 시간(초)을 반환
     """
+    wait_time = 0
     try:
         if not file_path or not os.path.exists(file_path):
             st.error(f"파일 경로 오류: {file_path}")
@@ -995,30 +1380,24 @@ def play_audio(file_path, sentence_interval=1.0, next_sentence=False):
 
         settings = st.session_state.settings
         playback_method = settings.get('audio_playback_method', 'html5')
-        wait_mode = settings.get('audio_wait_mode', 'duration')
 
-        # WAV 파일에서 실제 재생 시간 계산
-        try:
-            with wave.open(file_path, 'rb') as wav_file:
-                frames = wav_file.getnframes()
-                rate = wav_file.getframerate()
-                duration = frames / float(rate)
-        except Exception:
-            with open(file_path, 'rb') as f:
-                audio_bytes = f.read()
-            duration = len(audio_bytes) / 32000
+        # 실제 재생 시간 (MP3 프레임 헤더 기준, 캐시 항목은 저장된 값)
+        duration = get_audio_duration(file_path)
 
+        inject_started = time.perf_counter()
         if playback_method == 'html5':
-            # HTML5 Audio 방식
-            with open(file_path, 'rb') as f:
-                audio_bytes = f.read()
-            audio_base64 = base64.b64encode(audio_bytes).decode()
+            # HTML5 Audio 방식 - 캐시된 파일은 URL로 참조 (브라우저 HTTP 캐시 사용)
+            audio_src = get_audio_url(file_path)
+            if audio_src is None:
+                # 정적 경로 밖의 파일은 base64로 삽입 (인코딩 결과는 메모리에 보관하여 반복 재생 시 재사용)
+                clip = get_hot_clip(file_path, encode=True)
+                audio_src = f"data:{audio_mime_type(clip['bytes'])};base64,{clip['b64']}"
 
             audio_id = f"audio_{int(time.time() * 1000)}"
             
             st.markdown(f"""
                 <audio id="{audio_id}" autoplay="true">
-                    <source src="data:audio/wav;base64,{audio_base64}" type="audio/wav">
+                    <source src="{audio_src}">
                 </audio>
                 <script>
                     (function() {{
@@ -1045,23 +1424,16 @@ def play_audio(file_path, sentence_interval=1.0, next_sentence=False):
             """, unsafe_allow_html=True)
         else:
             # Streamlit Audio 방식
-            with open(file_path, 'rb') as f:
-                audio_bytes = f.read()
-            st.audio(audio_bytes, format='audio/wav')
+            audio_bytes = read_clip_bytes(file_path)
+            st.audio(audio_bytes, format=audio_mime_type(audio_bytes))
+        record_span('audio_inject', time.perf_counter() - inject_started)
 
         # 대기 시간 계산
-        if wait_mode == 'fixed':
-            wait_time = settings.get('fixed_wait_time', 2.0)
-        else:
-            if next_sentence:
-                wait_time = duration + 0.3
-            else:
-                base_wait = duration
-                extra_wait = duration * 0.1 if duration > 5 else 0.5
-                wait_time = base_wait + extra_wait + sentence_interval
-                wait_time = max(wait_time, duration + 0.3)
+        wait_time = clip_wait_time(duration, sentence_interval, next_sentence, settings)
 
-        time.sleep(wait_time)
+        if wait:
+            time.sleep(wait_time)
+            wait_time = 0
 
     except Exception as e:
         st.error(f"음성 재생 오류: {str(e)}")
@@ -1071,35 +1443,878 @@ def play_audio(file_path, sentence_interval=1.0, next_sentence=False):
                 os.remove(file_path)
         except Exception:
             pass
+    return wait_time
+
+# 구간별 소요 시간 측정 (프로세스 전역, 이름 -> 횟수/합계/최대/구간별 횟수)
+_metrics = {}
+_metrics_lock = threading.Lock()
+_metrics_writer = {'thread': None}
+_process = {'handle': None}
+_lazy_modules = {}
+
+def record_span(name, seconds):
+    """소요 시간 한 건을 히스토그램에 누적"""
+    with _metrics_lock:
+        span = _metrics.get(name)
+        if span is None:
+            span = _metrics[name] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * len(METRICS_BUCKETS)}
+        span['count'] += 1
+        span['sum'] += seconds
+        span['max'] = max(span['max'], seconds)
+        for i, bound in enumerate(METRICS_BUCKETS):
+            if seconds <= bound:
+                span['buckets'][i] += 1
+                break
+
+@contextmanager
+def timing_span(name):
+    """with 블록의 소요 시간을 name 구간으로 기록"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+def lazy_import(name):
+    """모듈을 처음 필요할 때 불러오기 (소요 시간은 import:<이름> 구간으로 기록)"""
+    module = _lazy_modules.get(name)
+    if module is None:
+        with timing_span(f'import:{name}'):
+            module = importlib.import_module(name)
+        _lazy_modules[name] = module
+    return module
+
+def _bucket_quantile(span, q):
+    """구간별 횟수로 추정한 분위수 (해당 구간의 상한, 마지막 구간을 넘으면 최대값)"""
+    target = q * span['count']
+    seen = 0
+    for bound, count in zip(METRICS_BUCKETS, span['buckets']):
+        seen += count
+        if seen >= target:
+            return min(bound, span['max'])
+    return span['max']
+
+def get_span_metrics():
+    """구간별 요약 {이름: {count, mean_ms, p50_ms, p90_ms, max_ms, total_s}}"""
+    with _metrics_lock:
+        spans = {name: dict(span, buckets=list(span['buckets'])) for name, span in _metrics.items()}
+    return {
+        name: {
+            'count': span['count'],
+            'mean_ms': round(span['sum'] / span['count'] * 1000, 2),
+            'p50_ms': round(_bucket_quantile(span, 0.5) * 1000, 2),
+            'p90_ms': round(_bucket_quantile(span, 0.9) * 1000, 2),
+            'max_ms': round(span['max'] * 1000, 2),
+            'total_s': round(span['sum'], 3)
+        }
+        for name, span in sorted(spans.items())
+    }
+
+def sample_process_metrics():
+    """프로세스 자원 사용량 (RSS, 직전 호출 이후 CPU 사용률, 스레드 수)"""
+    process = _process['handle']
+    if process is None:
+        process = _process['handle'] = lazy_import('psutil').Process()
+    with process.oneshot():
+        return {
+            'rss_bytes': process.memory_info().rss,
+            'cpu_percent': process.cpu_percent(interval=None),
+            'threads': process.num_threads()
+        }
+
+def format_prometheus_metrics():
+    """측정값을 Prometheus 텍스트 형식으로 변환"""
+    with _metrics_lock:
+        spans = {name: dict(span, buckets=list(span['buckets'])) for name, span in _metrics.items()}
+    lines = ['# HELP en600_span_seconds 구간별 소요 시간', '# TYPE en600_span_seconds histogram']
+    for name, span in sorted(spans.items()):
+        cumulative = 0
+        for bound, count in zip(METRICS_BUCKETS, span['buckets']):
+            cumulative += count
+            lines.append(f'en600_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'en600_span_seconds_bucket{{span="{name}",le="+Inf"}} {span["count"]}')
+        lines.append(f'en600_span_seconds_sum{{span="{name}"}} {span["sum"]:.6f}')
+        lines.append(f'en600_span_seconds_count{{span="{name}"}} {span["count"]}')
+    for prefix, stats in (('tts_cache', TTS_CACHE_STATS), ('tts_client', TTS_CLIENT_STATS), ('clip_hot_tier', CLIP_HOT_TIER_STATS)):
+        for key, value in stats.items():
+            metric_type = 'gauge' if key == 'bytes' else 'counter'
+            metric = f"en600_{prefix}_{key}" + ('' if metric_type == 'gauge' else '_total')
+            lines.append(f'# TYPE {metric} {metric_type}')
+            lines.append(f'{metric} {value}')
+    process = sample_process_metrics()
+    lines.append('# TYPE en600_process_resident_memory_bytes gauge')
+    lines.append(f"en600_process_resident_memory_bytes {process['rss_bytes']}")
+    lines.append('# TYPE en600_process_cpu_percent gauge')
+    lines.append(f"en600_process_cpu_percent {process['cpu_percent']}")
+    lines.append('# TYPE en600_process_threads gauge')
+    lines.append(f"en600_process_threads {process['threads']}")
+    return '\n'.join(lines) + '\n'
+
+def write_metrics_file(path=None):
+    """측정값 파일을 임시 파일에 쓴 뒤 이름 변경 (수집기가 반쯤 쓴 파일을 읽지 않음)"""
+    path = Path(path or METRICS_FILE)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(format_prometheus_metrics())
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+def start_metrics_writer():
+    """METRICS_FILE이 지정되어 있으면 METRICS_FILE_INTERVAL초마다 기록하는 스레드 시작 (프로세스당 1회)"""
+    if not METRICS_FILE:
+        return
+    with _metrics_lock:
+        if _metrics_writer['thread'] is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    write_metrics_file()
+                except Exception:
+                    traceback.print_exc()
+                time.sleep(METRICS_FILE_INTERVAL)
+
+        _metrics_writer['thread'] = threading.Thread(target=run, name='metrics-writer', daemon=True)
+        _metrics_writer['thread'].start()
+
+# TTS 캐시 상태 (프로세스 전역, 세션 간 공유)
+_tts_cache_lock = threading.Lock()
+_tts_cache_index = None
+_tts_cache_dirty = False
+_tts_cache_last_flush = 0.0
+TTS_CACHE_STATS = {'hits': 0, 'misses': 0, 'evictions': 0}
+_clip_hot_tier = OrderedDict()  # 캐시 키 -> {'bytes', 'b64', 'duration', 'size'} (최근 재생 순)
+_clip_hot_tier_lock = threading.Lock()
+CLIP_HOT_TIER_STATS = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+def speed_to_rate(speed):
+    """배속을 edge-tts rate 문자열로 변환 (예: 1.5 -> '+50%', 0.8 -> '-20%')"""
+    return f"{int(round((speed - 1) * 100)):+d}%"
+
+def rate_to_speed(rate):
+    """edge-tts rate 문자열을 배속으로 변환 (예: '+50%' -> 1.5)"""
+    return 1 + int(rate.rstrip('%')) / 100
+
+def tts_cache_key(text, voice, rate, backend='edge'):
+    """(정규화된 텍스트, 음성, 속도)의 전체 해시로 캐시 키 생성 (edge 외 엔진은 엔진 이름 포함)"""
+    text = normalize_text(text)
+    fields = [text, voice, rate] if backend == 'edge' else [backend, text, voice, rate]
+    payload = json.dumps(fields, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def tts_cache_path(key, audio_format='mp3'):
+    """캐시 키에 해당하는 오디오 파일 경로 (확장자는 엔진 출력 형식, 정적 파일 URL의 MIME 형식도 이것으로 결정)"""
+    return TTS_CACHE_DIR / f"{key}.{audio_format}"
+
+def tts_cache_entry_path(key, entry):
+    """인덱스 항목의 오디오 파일 경로 (형식이 기록되지 않은 이전 항목은 MP3)"""
+    return tts_cache_path(key, entry.get('format', 'mp3'))
+
+def tts_cache_meta_path(key):
+    """캐시 항목별 메타데이터 파일 경로 (다른 프로세스/서버와 공유되는 원본 정보)"""
+    return TTS_CACHE_META_DIR / f"{key}.json"
+
+def tts_cache_lock_path(key):
+    """캐시 항목별 합성 잠금 파일 경로"""
+    return TTS_CACHE_META_DIR / 'locks' / f"{key}.lock"
+
+def _move_legacy_tts_cache_meta():
+    """이전 버전이 오디오 폴더(정적 파일로 공개됨)에 둔 인덱스/메타데이터/잠금 파일을 메타데이터 폴더로 이동"""
+    if TTS_CACHE_DIR.resolve() == TTS_CACHE_META_DIR.resolve():
+        return
+    for path in TTS_CACHE_DIR.glob('*.json'):
+        try:
+            if (TTS_CACHE_META_DIR / path.name).exists():
+                path.unlink()
+            else:
+                shutil.move(str(path), TTS_CACHE_META_DIR / path.name)
+        except OSError:
+            pass
+    shutil.rmtree(TTS_CACHE_DIR / 'locks', ignore_errors=True)
+
+def _load_tts_cache_index():
+    """캐시 인덱스 파일 로드 (최초 1회) - 인덱스에 없는 항목별 메타데이터도 반영"""
+    global _tts_cache_index
+    if _tts_cache_index is None:
+        TTS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        TTS_CACHE_META_DIR.mkdir(parents=True, exist_ok=True)
+        _move_legacy_tts_cache_meta()
+        try:
+            with open(TTS_CACHE_INDEX_PATH, 'r', encoding='utf-8') as f:
+                _tts_cache_index = json.load(f)
+        except Exception:
+            _tts_cache_index = {}
+        # 이전 버전 인덱스에 들어 있던 단어 시각/자막 큐 목록은 메타데이터 파일에만 유지
+        for entry in _tts_cache_index.values():
+            for field in TTS_CACHE_DETAIL_FIELDS:
+                entry.pop(field, None)
+        # 다른 프로세스가 저장한 항목 반영
+        for meta_path in TTS_CACHE_META_DIR.glob('*.json'):
+            if meta_path != TTS_CACHE_INDEX_PATH and meta_path.stem not in _tts_cache_index:
+                entry = _read_tts_cache_meta(meta_path.stem)
+                if entry is not None:
+                    _tts_cache_index[meta_path.stem] = entry
+        # 인덱스에 있지만 파일이 없는 항목 정리
+        for key in [k for k, entry in _tts_cache_index.items() if not tts_cache_entry_path(k, entry).exists()]:
+            del _tts_cache_index[key]
+    return _tts_cache_index
+
+# 항목별 메타데이터 파일에만 기록하는 큰 필드 (인덱스에는 넣지 않음)
+TTS_CACHE_DETAIL_FIELDS = ('words', 'cues')
+
+def _read_tts_cache_meta(key, detail=False):
+    """항목별 메타데이터 읽기 (없거나 손상되었으면 None) - detail=False이면 단어 시각/자막 큐 목록 제외"""
+    try:
+        with open(tts_cache_meta_path(key), 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except Exception:
+        return None
+    if not detail:
+        for field in TTS_CACHE_DETAIL_FIELDS:
+            entry.pop(field, None)
+    return entry
+
+def _write_tts_cache_meta(key, entry):
+    """항목별 메타데이터를 임시 파일에 쓴 뒤 이름 변경 (다른 프로세스가 반쯤 쓴 파일을 읽지 않음)"""
+    meta_path = tts_cache_meta_path(key)
+    tmp_path = meta_path.with_name(f"{key}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+def _tts_cache_entry(key):
+    """인덱스 항목 조회 - 없으면 다른 프로세스가 저장한 메타데이터 확인 (잠금 상태에서 호출)"""
+    global _tts_cache_dirty
+    index = _load_tts_cache_index()
+    entry = index.get(key)
+    if entry is None:
+        entry = _read_tts_cache_meta(key)
+        if entry is None or not tts_cache_entry_path(key, entry).exists():
+            return None
+        index[key] = entry
+        _tts_cache_dirty = True
+    return entry
+
+def _flush_tts_cache_index(force=False):
+    """변경된 캐시 인덱스를 파일에 저장 (잠금 상태에서 호출)"""
+    global _tts_cache_dirty, _tts_cache_last_flush
+    if not _tts_cache_dirty:
+        return
+    now = time.time()
+    if not force and now - _tts_cache_last_flush < TTS_CACHE_INDEX_FLUSH_INTERVAL:
+        return
+    # 같은 저장소를 공유하는 다른 프로세스와 임시 파일이 겹치지 않도록 고유 이름 사용
+    tmp_path = TTS_CACHE_INDEX_PATH.with_name(f"{TTS_CACHE_INDEX_PATH.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(_tts_cache_index, f, ensure_ascii=False)
+        os.replace(tmp_path, TTS_CACHE_INDEX_PATH)
+        _tts_cache_dirty = False
+        _tts_cache_last_flush = now
+    except Exception:
+        traceback.print_exc()
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+def tts_cache_lookup(key):
+    """캐시 조회 - 적중 시 파일 경로 반환, 미스 시 None"""
+    global _tts_cache_dirty
+    with _tts_cache_lock:
+        index = _load_tts_cache_index()
+        entry = _tts_cache_entry(key)
+        path = tts_cache_entry_path(key, entry) if entry is not None else None
+        if entry is not None and path.exists():
+            entry['last_access'] = time.time()
+            _tts_cache_dirty = True
+            TTS_CACHE_STATS['hits'] += 1
+            _flush_tts_cache_index()
+            return path
+        if entry is not None:
+            del index[key]
+            _tts_cache_dirty = True
+        TTS_CACHE_STATS['misses'] += 1
+        return None
+
+def tts_cache_store(key, path, words=None, cues=None, **meta):
+    """생성된 오디오 파일을 캐시 인덱스에 등록하고 용량 초과 시 정리
+
+    단어 시각 목록(words)과 트랙 자막 큐(cues)는 항목별 메타데이터 파일에만 기록 (인덱스에는 넣지 않음)
+    """
+    global _tts_cache_dirty
+    detail = {field: value for field, value in (('words', words), ('cues', cues)) if value is not None}
+    with _tts_cache_lock:
+        index = _load_tts_cache_index()
+        now = time.time()
+        index[key] = dict(meta, size=path.stat().st_size, created=now, last_access=now)
+        _write_tts_cache_meta(key, dict(index[key], **detail))
+        _tts_cache_dirty = True
+        _evict_tts_cache()
+        # 인덱스 전체 기록은 일정 간격으로만 (항목별 메타데이터가 원본, 삭제된 항목은 다음 로드 시 정리됨)
+        _flush_tts_cache_index()
+
+def flush_tts_cache_index():
+    """대기 중인 캐시 인덱스 변경을 즉시 저장 (프로세스 종료 시 호출)"""
+    with _tts_cache_lock:
+        if _tts_cache_index is not None:
+            _flush_tts_cache_index(force=True)
+
+atexit.register(flush_tts_cache_index)
+
+def _evict_tts_cache(max_bytes=None):
+    """최근 사용 순(LRU)으로 용량 한도를 넘는 항목 삭제 (잠금 상태에서 호출) - 삭제한 항목 수 반환"""
+    global _tts_cache_dirty
+    max_bytes = TTS_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    index = _load_tts_cache_index()
+    total = sum(entry.get('size', 0) for entry in index.values())
+    evicted = 0
+    if total <= max_bytes:
+        return evicted
+    for key, entry in sorted(index.items(), key=lambda item: item[1].get('last_access', 0)):
+        if total <= max_bytes:
+            break
+        try:
+            tts_cache_entry_path(key, entry).unlink(missing_ok=True)
+            tts_cache_meta_path(key).unlink(missing_ok=True)
+            tts_cache_lock_path(key).unlink(missing_ok=True)
+        except Exception:
+            continue
+        _drop_hot_clip(key)
+        total -= entry.get('size', 0)
+        del index[key]
+        evicted += 1
+        TTS_CACHE_STATS['evictions'] += 1
+        _tts_cache_dirty = True
+    return evicted
+
+def hot_clip_key(file_path):
+    """메모리 보관 키 - 캐시 항목은 캐시 키, 그 외 파일(break.wav 등)은 경로와 수정 시각"""
+    path = Path(file_path)
+    if path.parent == TTS_CACHE_DIR:
+        return path.stem
+    stat = path.stat()
+    return f"{path}:{stat.st_mtime_ns}:{stat.st_size}"
+
+def get_hot_clip(file_path, encode=False):
+    """메모리에 보관된 클립 {'bytes', 'b64', 'duration'} 조회, 없으면 한 번 읽어 보관
+
+    encode=True이면 base64 문자열도 한 번만 만들어 함께 보관 (용량에 포함)
+    """
+    key = hot_clip_key(file_path)
+    with _clip_hot_tier_lock:
+        clip = _clip_hot_tier.get(key)
+        if clip is not None:
+            _clip_hot_tier.move_to_end(key)
+            CLIP_HOT_TIER_STATS['hits'] += 1
+            if not encode or clip['b64'] is not None:
+                return clip
+        else:
+            CLIP_HOT_TIER_STATS['misses'] += 1
+    if clip is None:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        clip = {'bytes': data, 'b64': None, 'duration': get_audio_duration(file_path), 'size': len(data)}
+    if encode and clip['b64'] is None:
+        with timing_span('base64_encode'):
+            clip = dict(clip, b64=base64.b64encode(clip['bytes']).decode())
+        clip['size'] = len(clip['bytes']) + len(clip['b64'])
+    if TEMP_DIR not in Path(file_path).parents:  # 재생 후 삭제되는 임시 파일은 보관하지 않음
+        _store_hot_clip(key, clip)
+    return clip
+
+def _store_hot_clip(key, clip):
+    """클립을 보관하고 용량(CLIP_HOT_TIER_MAX_BYTES)을 넘으면 오래된 것부터 제거"""
+    with _clip_hot_tier_lock:
+        previous = _clip_hot_tier.pop(key, None)
+        if previous is not None:
+            CLIP_HOT_TIER_STATS['bytes'] -= previous['size']
+        if clip['size'] > CLIP_HOT_TIER_MAX_BYTES:
+            return
+        _clip_hot_tier[key] = clip
+        CLIP_HOT_TIER_STATS['bytes'] += clip['size']
+        while CLIP_HOT_TIER_STATS['bytes'] > CLIP_HOT_TIER_MAX_BYTES:
+            _, evicted = _clip_hot_tier.popitem(last=False)
+            CLIP_HOT_TIER_STATS['bytes'] -= evicted['size']
+            CLIP_HOT_TIER_STATS['evictions'] += 1
+
+def _drop_hot_clip(key):
+    """캐시에서 삭제된 항목을 메모리에서도 제거"""
+    with _clip_hot_tier_lock:
+        clip = _clip_hot_tier.pop(key, None)
+        if clip is not None:
+            CLIP_HOT_TIER_STATS['bytes'] -= clip['size']
+
+def read_clip_bytes(file_path):
+    """오디오 데이터 읽기 (메모리에 보관된 클립 재사용)"""
+    return get_hot_clip(file_path)['bytes']
+
+def get_clip_hot_tier_stats():
+    """메모리 보관 통계 (적중/미스/제거 횟수, 항목 수, 용량)"""
+    with _clip_hot_tier_lock:
+        return dict(CLIP_HOT_TIER_STATS, entries=len(_clip_hot_tier), max_bytes=CLIP_HOT_TIER_MAX_BYTES)
+
+def get_tts_cache_stats():
+    """캐시 통계 (적중/미스/삭제 횟수, 항목 수, 용량)"""
+    with _tts_cache_lock:
+        index = _load_tts_cache_index()
+        stats = dict(TTS_CACHE_STATS)
+        stats['entries'] = len(index)
+        stats['bytes'] = sum(entry.get('size', 0) for entry in index.values())
+        return stats
+
+def is_tts_cached(text, voice, speed, backend=None):
+    """통계에 반영하지 않고 캐시 존재 여부만 확인"""
+    key = tts_cache_key(text, voice, speed_to_rate(speed), backend or TTS_BACKEND)
+    with _tts_cache_lock:
+        entry = _tts_cache_entry(key)
+        return entry is not None and tts_cache_entry_path(key, entry).exists()
+
+async def synthesize_to_cache(text, voice, speed=1.0, backend=None):
+    """캐시 조회 후 없으면 TTS 클라이언트로 합성하여 캐시에 저장 (오류는 호출자에게 전달)"""
+    backend = backend or TTS_BACKEND
+    text = cell_text(text)
+    if not normalize_text(text):
+        raise ValueError("빈 텍스트는 합성하지 않음")
+    rate = speed_to_rate(speed)
+    key = tts_cache_key(text, voice, rate, backend)
+    started = time.perf_counter()
+    cached = tts_cache_lookup(key)
+    if cached is not None:
+        record_span('voice_file_hit', time.perf_counter() - started)
+        return cached
+    path = Path(await request_synthesis(key, text, voice, rate, backend))
+    record_span('voice_file_synthesis', time.perf_counter() - started)
+    return path
+
+# TTS 클라이언트 (프로세스 전역 이벤트 루프 스레드에서 모든 세션의 합성 요청 처리)
+_tts_client = {'loop': None, 'thread': None, 'semaphore': None, 'inflight': {}, 'voice_next': {}}
+_tts_client_lock = threading.Lock()
+TTS_CLIENT_STATS = {'requests': 0, 'coalesced': 0, 'retries': 0, 'failures': 0, 'fallbacks': 0}
+
+def _get_tts_client_loop():
+    """TTS 클라이언트 이벤트 루프 (최초 호출 시 백그라운드 스레드 시작)"""
+    with _tts_client_lock:
+        if _tts_client['loop'] is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='tts-client', daemon=True)
+            thread.start()
+            _tts_client.update(loop=loop, thread=thread, semaphore=asyncio.Semaphore(TTS_MAX_CONCURRENCY))
+        return _tts_client['loop']
+
+async def request_synthesis(key, text, voice, rate, backend='edge'):
+    """합성 요청 - 같은 키의 진행 중인 요청이 있으면 그 결과를 함께 기다림 (요청 병합)"""
+    loop = _get_tts_client_loop()
+    with _tts_client_lock:
+        TTS_CLIENT_STATS['requests'] += 1
+        future = _tts_client['inflight'].get(key)
+        created = future is None
+        if not created:
+            TTS_CLIENT_STATS['coalesced'] += 1
+        else:
+            future = asyncio.run_coroutine_threadsafe(_synthesis_job(key, text, voice, rate, backend), loop)
+            _tts_client['inflight'][key] = future
+    if created:
+        # 이미 끝난 작업이면 콜백이 바로 실행되므로 잠금 밖에서 등록 (같은 잠금을 다시 잡아 멈추지 않도록)
+        future.add_done_callback(lambda _: _forget_inflight(key))
+    # 호출자가 취소되어도 합성은 계속되어 캐시를 채우고 다른 대기자에게 결과 전달
+    return await asyncio.shield(asyncio.wrap_future(future))
+
+def _forget_inflight(key):
+    """완료된 요청을 진행 중 목록에서 제거"""
+    with _tts_client_lock:
+        _tts_client['inflight'].pop(key, None)
+
+async def _wait_for_voice_slot(voice):
+    """음성별 요청 간격 제한 - 같은 음성 요청은 TTS_VOICE_MIN_INTERVAL초 이상 간격을 둠"""
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    slot = max(now, _tts_client['voice_next'].get(voice, 0))
+    _tts_client['voice_next'][voice] = slot + TTS_VOICE_MIN_INTERVAL
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+async def _synthesis_job(key, text, voice, rate, backend):
+    """TTS 클라이언트 루프에서 실행: 동시 합성 수 제한, 지수 백오프(지터) 재시도 후 캐시에 저장
+
+    재시도가 모두 실패하면 대체 엔진(TTS_FALLBACK_BACKEND)이 있을 때 그 결과를 대신 반환
+    """
+    engine = get_tts_backend(backend)
+    lock_file = await _acquire_clip_lock(key)
+    try:
+        # 잠금을 기다리는 동안 다른 프로세스/서버가 합성을 마쳤으면 그 결과 사용
+        cached = tts_cache_lookup(key)
+        if cached is not None:
+            return str(cached)
+        return await _synthesize_locked(key, engine, text, voice, rate, backend)
+    finally:
+        _release_clip_lock(lock_file)
+
+async def _acquire_clip_lock(key):
+    """항목별 잠금 파일에 배타 잠금 (이벤트 루프를 막지 않도록 비차단 시도를 반복, fcntl이 없으면 None)"""
+    if fcntl is None:
+        return None
+    lock_path = tts_cache_lock_path(key)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    lock_file = open(lock_path, 'a')
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock_file
+        except BlockingIOError:
+            await asyncio.sleep(TTS_CACHE_LOCK_POLL)
+        except Exception:
+            lock_file.close()
+            raise
+
+def _release_clip_lock(lock_file):
+    """잠금 해제 (잠금 파일은 남겨 두고 캐시 정리 시 함께 삭제)"""
+    if lock_file is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+async def _synthesize_locked(key, engine, text, voice, rate, backend):
+    """잠금을 잡은 상태에서 재시도하며 합성"""
+    cache_file = tts_cache_path(key, engine['format'])
+    for attempt in range(TTS_MAX_RETRIES + 1):
+        if engine['remote']:
+            await _wait_for_voice_slot(voice)
+        async with _tts_client['semaphore']:
+            try:
+                words = await _render_to_file(engine, text, voice, rate, cache_file)
+                break
+            except Exception:
+                if attempt == TTS_MAX_RETRIES:
+                    TTS_CLIENT_STATS['failures'] += 1
+                    fallback = _fallback_backend(backend)
+                    if fallback is None:
+                        raise
+                    traceback.print_exc()
+                    return await _fallback_synthesis(fallback, text, voice, rate)
+                TTS_CLIENT_STATS['retries'] += 1
+        delay = min(TTS_BACKOFF_MAX, TTS_BACKOFF_BASE * 2 ** attempt)
+        await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+    tts_cache_store(key, cache_file, voice=voice, rate=rate, backend=backend, format=engine['format'],
+                    duration=probe_audio_duration(cache_file), words=words)
+    return str(cache_file)
+
+def _fallback_backend(backend):
+    """사용 가능한 대체 엔진 이름 (없거나 현재 엔진과 같으면 None)"""
+    fallback = TTS_FALLBACK_BACKEND
+    if fallback == backend or fallback not in TTS_BACKENDS or not TTS_BACKENDS[fallback]['available']():
+        return None
+    return fallback
+
+async def _fallback_synthesis(backend, text, voice, rate):
+    """대체 엔진으로 합성하여 그 엔진의 캐시 키로 저장 (원래 엔진이 복구되면 다시 합성됨)"""
+    key = tts_cache_key(text, voice, rate, backend)
+    cached = tts_cache_lookup(key)
+    if cached is not None:
+        return str(cached)
+    engine = get_tts_backend(backend)
+    cache_file = tts_cache_path(key, engine['format'])
+    words = await _render_to_file(engine, text, voice, rate, cache_file)
+    TTS_CLIENT_STATS['fallbacks'] += 1
+    tts_cache_store(key, cache_file, voice=voice, rate=rate, backend=backend, format=engine['format'],
+                    duration=probe_audio_duration(cache_file), words=words)
+    return str(cache_file)
+
+async def _render_to_file(engine, text, voice, rate, output_file):
+    """엔진 출력을 임시 파일에 받은 뒤 이름 변경, 단어 경계 시각 목록 반환"""
+    tmp_file = output_file.with_name(f"{output_file.stem}.{uuid.uuid4().hex}.part")
+    try:
+        words = await engine['synthesize'](text, voice, rate, tmp_file)
+        if not tmp_file.exists() or tmp_file.stat().st_size == 0:
+            raise RuntimeError("음성 파일이 생성되지 않았습니다.")
+        os.replace(tmp_file, output_file)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+    return words
+
+async def _edge_synthesize(text, voice, rate, output_file):
+    """edge-tts로 MP3 합성
+
+    edge-tts는 요청마다 웹소켓을 새로 열고 서버가 응답 후 닫으므로 연결 재사용은 불가
+    """
+    words = []
+    communicate = _create_communicate(text, voice, rate)
+    with open(output_file, 'wb') as f:
+        async for chunk in communicate.stream():
+            if chunk['type'] == 'audio':
+                f.write(chunk['data'])
+            elif chunk['type'] == 'WordBoundary':
+                # edge-tts 시각 단위는 100ns -> ms로 저장 [시작, 길이, 단어]
+                words.append([round(chunk['offset'] / 10000), round(chunk['duration'] / 10000), chunk['text']])
+    return words
+
+def _create_communicate(text, voice, rate):
+    """단어 경계 이벤트를 보내도록 edge-tts 요청 생성 (boundary 인자가 없는 이전 버전은 기본값이 단어 경계)"""
+    edge_tts = lazy_import('edge_tts')
+    try:
+        return edge_tts.Communicate(text, voice, rate=rate, boundary='WordBoundary')
+    except TypeError:
+        return edge_tts.Communicate(text, voice, rate=rate)
+
+def local_tts_language(voice):
+    """edge-tts 음성 ID에서 오프라인 엔진 언어 코드 추출 (예: 'en-US-JennyNeural' -> 'en-us')"""
+    parts = voice.split('-')
+    if len(parts) < 2:
+        return voice
+    lang = parts[0].lower()
+    if lang == 'zh':
+        return 'cmn'
+    return f"{lang}-{parts[1].lower()}" if lang == 'en' else lang
+
+def _local_tts_available():
+    """오프라인 TTS 실행 파일 존재 여부"""
+    return shutil.which(LOCAL_TTS_COMMAND) is not None
+
+async def _local_synthesize(text, voice, rate, output_file):
+    """오프라인 TTS 실행 파일(espeak-ng 호환 인자)로 WAV 합성 (단어 경계 없음)"""
+    wpm = max(80, int(LOCAL_TTS_WPM * rate_to_speed(rate)))
+    process = await asyncio.create_subprocess_exec(
+        LOCAL_TTS_COMMAND, '-v', local_tts_language(voice), '-s', str(wpm), '-w', str(output_file), text,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"{LOCAL_TTS_COMMAND} 오류: {stderr.decode('utf-8', 'replace').strip()}")
+    return []
+
+def fake_tts_word_times(text, speed=1.0):
+    """테스트 엔진의 단어 시각 [[시작 ms, 길이 ms, 단어], ...] - 글자 수에 비례 (한중일 문자는 더 길게)"""
+    words = []
+    position = 0
+    for word in text.split():
+        length = sum(180 if ord(ch) >= 0x2E80 else 60 for ch in word) / speed
+        words.append([round(position), round(length), word])
+        position += length + 80 / speed
+    return words
+
+async def _fake_synthesize(text, voice, rate, output_file):
+    """네트워크 없이 결정적인 WAV 생성 - 음성별 고정 주파수 톤, 길이와 단어 시각은 글자 수와 속도로 계산"""
+    if FAKE_TTS_LATENCY:
+        await asyncio.sleep(FAKE_TTS_LATENCY)
+    words = fake_tts_word_times(text, rate_to_speed(rate))
+    total_ms = max(300, words[-1][0] + words[-1][1] + 100 if words else 0)
+    frequency = 220 + int(hashlib.md5(voice.encode('utf-8')).hexdigest(), 16) % 8 * 55
+    t = np.arange(int(TRACK_FRAME_RATE * total_ms / 1000)) / TRACK_FRAME_RATE
+    envelope = np.zeros_like(t)
+    for start, length, _ in words:
+        envelope[(t >= start / 1000) & (t < (start + length) / 1000)] = 0.2
+    samples = (np.sin(2 * np.pi * frequency * t) * envelope * 32767).astype('<i2')
+    with wave.open(str(output_file), 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(TRACK_FRAME_RATE)
+        wav_file.writeframes(samples.tobytes())
+    return words
+
+# 음성 합성 엔진 (synthesize(text, voice, rate, output_file) -> 단어 시각 목록, format: 출력 파일 형식)
+TTS_BACKENDS = {
+    'edge': {'label': 'edge-tts (온라인)', 'synthesize': _edge_synthesize, 'available': lambda: True, 'remote': True, 'format': 'mp3'},
+    'local': {'label': '오프라인 (espeak-ng)', 'synthesize': _local_synthesize, 'available': _local_tts_available, 'remote': False, 'format': 'wav'},
+    'fake': {'label': '테스트 (톤 생성)', 'synthesize': _fake_synthesize, 'available': lambda: True, 'remote': False, 'format': 'wav'},
+}
+
+def get_tts_backend(name=None):
+    """이름으로 합성 엔진 조회 (없는 이름이면 ValueError)"""
+    name = name or TTS_BACKEND
+    if name not in TTS_BACKENDS:
+        raise ValueError(f"알 수 없는 TTS 엔진: {name} (사용 가능: {', '.join(TTS_BACKENDS)})")
+    return TTS_BACKENDS[name]
+
+def get_clip_words(file_path):
+    """캐시된 클립의 단어 시각 목록 [[시작 ms, 길이 ms, 단어], ...] (없으면 빈 목록)
+
+    항목별 메타데이터 파일에서 필요할 때 읽고 메모리 보관 클립에 함께 보관
+    """
+    path = Path(file_path)
+    if path.parent != TTS_CACHE_DIR:
+        return []
+    clip = get_hot_clip(path)
+    if 'words' not in clip:
+        entry = _read_tts_cache_meta(path.stem, detail=True)
+        clip['words'] = entry.get('words') or [] if entry else []
+    return clip['words']
+
+def word_phrase_cues(speak_cues, max_words=6):
+    """단어 시각이 있는 음성 큐를 구 단위 자막 큐로 분할 (문장부호 또는 max_words 단어마다)"""
+    cues = []
+    for cue in speak_cues:
+        text = cue.get('text') or ''
+        cursor = 0
+        phrase = []
+        words = cue.get('words') or []
+        for index, word in enumerate(words):
+            phrase.append(word)
+            if len(phrase) < max_words and word[2][-1:] not in '.,!?;:。、，！？' and index < len(words) - 1:
+                continue
+            # 원문에서 구 범위를 잘라 띄어쓰기 유지 (찾지 못하면 단어를 공백으로 연결)
+            first = text.find(phrase[0][2], cursor)
+            last = text.find(phrase[-1][2], max(first, cursor))
+            if first >= 0 and last >= 0:
+                cursor = last + len(phrase[-1][2])
+                phrase_text = text[first:cursor]
+            else:
+                phrase_text = ' '.join(w[2] for w in phrase)
+            cues.append({
+                'rank': cue.get('rank'),
+                'kind': 'phrase',
+                'text': phrase_text,
+                'start': phrase[0][0],
+                'end': phrase[-1][0] + phrase[-1][1]
+            })
+            phrase = []
+    return cues
+
+def highlight_spoken_words(text, words, spoken_count):
+    """앞의 spoken_count개 단어까지 강조하고 나머지는 흐리게 표시한 자막 HTML"""
+    cursor = 0
+    for word in words[:spoken_count]:
+        found = text.find(word[2], cursor)
+        if found >= 0:
+            cursor = found + len(word[2])
+    if cursor >= len(text):
+        return text
+    return f'{text[:cursor]}<span style="opacity: 0.45;">{text[cursor:]}</span>'
+
+def clip_word_times(file_path, start):
+    """클립 단어 시각을 트랙 기준 절대 시각(초)으로 변환 [[시작, 길이, 단어], ...]"""
+    return [[start + offset / 1000, duration / 1000, word] for offset, duration, word in get_clip_words(file_path)]
+
+async def sync_subtitle_words(subtitles, rank, text, words, settings, started, plan=None):
+    """클립 재생 시작 시각 기준으로 단어가 발음될 때마다 자막 강조 갱신"""
+    loop = asyncio.get_running_loop()
+    for spoken in range(1, len(words) + 1):
+        delay = started + words[spoken - 1][0] / 1000 - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        render_subtitle(subtitles, rank, highlight_spoken_words(text, words, spoken), settings, plan)
+
+# MPEG 오디오 프레임 헤더 테이블 (비트레이트 kbps)
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+}
+_MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+_audio_duration_memo = {}
+
+def _parse_mp3_frame_header(data, pos):
+    """pos 위치의 MPEG 프레임 헤더 해석 - (프레임 길이, 샘플 수, 샘플레이트) 또는 None"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        return None
+    version = {0: 2.5, 2: 2, 3: 1}.get((data[pos + 1] >> 3) & 0x03)
+    layer = {1: 3, 2: 2, 3: 1}.get((data[pos + 1] >> 1) & 0x03)
+    bitrate_index = data[pos + 2] >> 4
+    sample_rate_index = (data[pos + 2] >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    padding = (data[pos + 2] >> 1) & 0x01
+    bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][sample_rate_index]
+    if layer == 1:
+        samples = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 576 if layer == 3 and version != 1 else 1152
+        frame_length = samples // 8 * bitrate // sample_rate + padding
+    return frame_length, samples, sample_rate
+
+def probe_mp3_duration(data):
+    """MP3 프레임 헤더를 순회하여 정확한 재생 시간(초) 계산 - 프레임이 없으면 None"""
+    pos = 0
+    # ID3v2 태그 건너뛰기
+    if data[:3] == b'ID3' and len(data) >= 10:
+        tag_size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        pos = 10 + tag_size + (10 if data[5] & 0x10 else 0)
+
+    duration = 0.0
+    frames = 0
+    while pos + 4 <= len(data):
+        header = _parse_mp3_frame_header(data, pos)
+        if header is None:
+            pos += 1  # 동기 재검색
+            continue
+        frame_length, samples, sample_rate = header
+        duration += samples / sample_rate
+        frames += 1
+        pos += frame_length
+    return duration if frames else None
+
+def probe_audio_duration(file_path):
+    """오디오 파일(WAV 또는 MP3) 재생 시간(초) 측정"""
+    with timing_span('duration_probe'):
+        return _probe_audio_duration(file_path)
+
+def _probe_audio_duration(file_path):
+    """파일 헤더로 재생 시간 계산 (WAV 헤더, MP3 프레임 헤더 순)"""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if data[:4] == b'RIFF':
+        try:
+            with wave.open(io.BytesIO(data), 'rb') as wav_file:
+                return wav_file.getnframes() / float(wav_file.getframerate())
+        except Exception:
+            pass
+    duration = probe_mp3_duration(data)
+    if duration is None:
+        duration = len(data) / 32000  # 형식을 알 수 없을 때의 추정치
+    return duration
+
+def get_audio_duration(file_path):
+    """재생 시간 조회 - 캐시 항목은 인덱스에 저장된 값 사용 (파일을 다시 열지 않음)"""
+    global _tts_cache_dirty
+    path = Path(file_path)
+    if path.parent == TTS_CACHE_DIR:
+        with _tts_cache_lock:
+            entry = _tts_cache_entry(path.stem)
+            if entry is not None and entry.get('duration') is not None:
+                return entry['duration']
+        duration = probe_audio_duration(path)
+        with _tts_cache_lock:
+            entry = _load_tts_cache_index().get(path.stem)
+            if entry is not None:
+                entry['duration'] = duration
+                _tts_cache_dirty = True
+        return duration
+
+    # 캐시 밖의 파일 (break.wav 등)은 수정 시각 기준으로 기억
+    stat = path.stat()
+    memo_key = (str(path), stat.st_mtime_ns, stat.st_size)
+    if memo_key not in _audio_duration_memo:
+        _audio_duration_memo[memo_key] = probe_audio_duration(path)
+    return _audio_duration_memo[memo_key]
 
 async def get_voice_file(text, voice, speed=1.0, output_file=None):
-    """음성 파일 생성 함수 개선"""
+    """음성 파일 생성 함수 개선 - 캐시에 있으면 합성 없이 재사용"""
     try:
-        # 빈 텍스트 체크
-        if not text or text.isspace():
+        # 빈 텍스트 체크 (NaN 셀 포함) - 합성에는 원문 그대로 사용
+        text = cell_text(text)
+        if not normalize_text(text):
             return None
-            
-        # 파일명 해시 생성
-        text_hash = hashlib.md5(text.encode()).hexdigest()
-        
-        if output_file is None:
-            output_file = TEMP_DIR / f"temp_{voice}_{speed}_{text_hash[:8]}.wav"
-            
-        # 이미 존재하는 파일이면 재사용
-        if output_file.exists():
+
+        rate = speed_to_rate(speed)
+
+        if output_file is not None:
+            # 지정된 경로로 직접 생성 (캐시 미사용)
+            output_file = Path(output_file)
+            if output_file.exists():
+                return str(output_file)
+            await _render_to_file(get_tts_backend(), text, voice, rate, output_file)
             return str(output_file)
-            
-        # edge-tts로 음성 생성
-        communicate = edge_tts.Communicate(text, voice, rate=f"+{int((speed-1)*100)}%")
-        await communicate.save(str(output_file))
-        
-        # 파일 생성 확인
-        if not output_file.exists():
-            st.error("음성 파일이 생성되지 않았습니다.")
-            return None
-            
-        return str(output_file)
-        
+
+        # 캐시 조회 및 합성
+        return str(await synthesize_to_cache(text, voice, speed))
+
     except Exception as e:
         st.warning(f"음성 생성 실패: {str(e)}")
         return None
@@ -1187,16 +2402,480 @@ def create_learning_ui():
 
     return progress, status, subtitles, speed_info
 
-async def create_break_audio():
-    """브레이크 음성 생성"""
-    break_msg = "쉬어가는 시간입니다, 5초간의 호흡을 느껴보세요"
-    break_voice = VOICE_MAPPING['korean']['선희']
-    audio_file = await get_voice_file(break_msg, break_voice, 1.0)
-    time.sleep(3)
-    return audio_file
+def create_playback_scheduler(time_scale=1.0, timeline_limit=PLAYBACK_TIMELINE_LIMIT):
+    """비동기 재생 스케줄러 상태 (기준 시각, 현재 재생이 끝나는 마감 시각, 이벤트 타임라인)
+
+    time_scale: 대기 시간 배율 (벤치마크에서 0으로 두면 재생/대기 없이 파이프라인만 측정)
+    """
+    now = asyncio.get_running_loop().time()
+    return {'t0': now, 'deadline': now, 'timeline': [], 'scale': time_scale, 'limit': timeline_limit}
+
+def record_playback_event(scheduler, kind, **info):
+    """타임라인에 재생 이벤트 기록 (최근 PLAYBACK_TIMELINE_LIMIT개 유지)"""
+    now = asyncio.get_running_loop().time()
+    scheduler['timeline'].append(dict(info, kind=kind, t=round(now - scheduler['t0'], 3)))
+    if len(scheduler['timeline']) > scheduler['limit']:
+        del scheduler['timeline'][0]
+
+async def wait_for_deadline(scheduler):
+    """현재 재생/대기 마감 시각까지 이벤트 루프를 막지 않고 대기"""
+    remaining = scheduler['deadline'] - asyncio.get_running_loop().time()
+    if remaining > 0:
+        with timing_span('playback_wait'):
+            await asyncio.sleep(remaining)
+
+def schedule_pause(scheduler, seconds):
+    """마감 시각을 seconds만큼 연장 (대기는 다음 wait_for_deadline에서)"""
+    now = asyncio.get_running_loop().time()
+    scheduler['deadline'] = max(scheduler['deadline'], now) + max(0, seconds) * scheduler['scale']
+
+async def schedule_clip(scheduler, file_path, sentence_interval=1.0, next_sentence=False, **info):
+    """앞 클립이 끝나면 재생을 시작하고 마감 시각을 이 클립의 종료 시각으로 설정"""
+    await wait_for_deadline(scheduler)
+    record_playback_event(scheduler, 'speak', **info)
+    wait_time = play_audio(file_path, sentence_interval, next_sentence, wait=False)
+    schedule_pause(scheduler, wait_time)
+
+def decode_audio(data):
+    """오디오 데이터를 AudioSegment로 디코딩 (WAV는 ffmpeg 없이 직접 읽음)"""
+    return lazy_import('pydub').AudioSegment.from_file(io.BytesIO(data), format='wav' if data[:4] == b'RIFF' else 'mp3')
+
+def track_cache_key(items):
+    """트랙 구성(클립 캐시 키, 간격, 자막)의 해시"""
+    parts = [[item[0], Path(item[1]).stem, item[2]] if item[0] == 'clip' else list(item) for item in items]
+    return hashlib.sha256(json.dumps(['track-v1', parts], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def render_audio_track(items, cache_key):
+    """트랙 항목을 하나의 MP3로 합치고 자막 큐 목록 생성 - (경로, 큐 목록, 길이)
+
+    같은 구성의 트랙은 TTS 캐시에서 재사용
+    """
+    if tts_cache_lookup(cache_key) is not None:
+        # 자막 큐는 항목별 메타데이터 파일에서 필요할 때만 읽음
+        entry = _read_tts_cache_meta(cache_key, detail=True) or {}
+        if 'cues' in entry:
+            return str(tts_cache_entry_path(cache_key, entry)), entry['cues'], entry['duration']
+
+    AudioSegment = lazy_import('pydub').AudioSegment
+    track = AudioSegment.silent(duration=0, frame_rate=TRACK_FRAME_RATE)
+    cues = []
+    for item in items:
+        if item[0] == 'silence':
+            track += AudioSegment.silent(duration=int(round(max(0, item[1]) * 1000)), frame_rate=TRACK_FRAME_RATE)
+        elif item[0] == 'subtitle':
+            cues.append(dict(item[1], kind='subtitle', start=len(track) / 1000))
+        elif item[0] == 'clip':
+            start = len(track)
+            track += decode_audio(read_clip_bytes(item[1])).set_frame_rate(TRACK_FRAME_RATE).set_channels(1)
+            cues.append(dict(item[2], kind='speak', start=start / 1000, end=len(track) / 1000,
+                             words=clip_word_times(item[1], start / 1000)))
+    duration = len(track) / 1000
+    for cue in cues:
+        cue.setdefault('end', duration)
+
+    path = tts_cache_path(cache_key)
+    tmp_path = path.with_name(f"{cache_key}.{uuid.uuid4().hex}.part")
+    try:
+        track.export(str(tmp_path), format='mp3', bitrate='48k')
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    tts_cache_store(cache_key, path, kind='track', format='mp3', duration=duration, cues=cues)
+    return str(path), cues, duration
+
+async def play_sentence_track(scheduler, track, subtitles, settings, sentence_number, plan=None):
+    """문장 트랙을 한 번에 재생하고 자막 큐 시각에 맞춰 자막 표시"""
+    path, cues, duration = track
+    loop = asyncio.get_running_loop()
+    await wait_for_deadline(scheduler)
+    started = loop.time()
+    record_playback_event(scheduler, 'speak', sentence=sentence_number, track=True)
+    play_audio(path, 0, True, wait=False)
+    scheduler['deadline'] = started + duration * scheduler['scale']
+    for cue in cues:
+        if cue['kind'] != 'subtitle' or rank_key_to_index(cue['rank']) >= len(subtitles):
+            continue
+        delay = started + cue['start'] * scheduler['scale'] - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        record_playback_event(scheduler, 'subtitle', sentence=sentence_number, rank=cue['rank'])
+        render_subtitle(subtitles, cue['rank'], cue['text'], settings, plan)
+
+def subtitle_template(settings, rank):
+    """순위별 자막 HTML 앞/뒤 조각 (글자 크기, 색상, 3번째 자막의 음성 모델 표시)"""
+    font_size = settings.get(f'{rank}_font_size', 22)
+    color = settings.get(f'{rank}_color', '#00FF00')
+    prefix = f"""
+            <div class="{rank}-text" 
+                 style="font-size: {font_size}px !important; color: {color};">
+                """
+
+    # 3번째 자막일 경우 모든 재생되는 음성 모델 표시
+    if rank_key_to_index(rank) == 2:  # 3번째 자막
+        # 재생되는 모든 음성 모델 수집
+        voice_models = []
+        for r, l_key in [('first', 'first_lang'), ('second', 'second_lang'), ('third', 'third_lang')]:
+            l = settings[l_key]
+            if l != 'none' and settings.get(f'{r}_repeat', 0) > 0:
+                voice_name = settings.get(f"{r}_{l}_voice", "")
+                if voice_name:
+                    voice_models.append(f"{voice_name}")
+        
+        voice_info = " | ".join(voice_models) if voice_models else ""
+        suffix = f"""
+                <br/>
+                <div style="font-size: {max(10, font_size//4)}px !important; color: #808080; opacity: 0.8;">
+                    {voice_info}
+                </div>
+            </div>
+            """
+    else:
+        # 1, 2번째 자막은 텍스트만 표시
+        suffix = """
+            </div>
+            """
+    return prefix, suffix
+
+def render_subtitle(subtitles, rank, text, settings, plan=None):
+    """순위별 자막 표시 (학습 계획이 있으면 미리 만든 HTML 조각 사용)"""
+    prefix, suffix = plan['subtitle_templates'][rank] if plan else subtitle_template(settings, rank)
+    with timing_span('subtitle_render'):
+        subtitles[rank_key_to_index(rank)].markdown(prefix + text + suffix, unsafe_allow_html=True)
+
+def format_speed(speed):
+    """배속 표시 문자열 (예: 1.0 -> '1', 1.25 -> '1.2')"""
+    speed = float(speed)
+    return str(int(speed)) if speed.is_integer() else f"{speed:.1f}"
+
+def build_session_plan(settings, lang_data):
+    """학습 시작 시 한 번 만드는 재생 계획 - 문장 루프는 이 계획을 인덱싱만 함
+
+    ranks: 재생할 순위별 {언어, 열 데이터, 음성 ID, 배속, 반복, 자막 여부/딜레이}
+    """
+    ranks = []
+    for rank, lang_key in [('first', 'first_lang'), ('second', 'second_lang'), ('third', 'third_lang')]:
+        lang = settings.get(lang_key, 'none')
+        if lang == 'none' or lang not in lang_data:
+            continue
+        speed = settings.get(f"{rank}_{lang}_speed", 1.2)
+        ranks.append({
+            'rank': rank,
+            'lang': lang,
+            'texts': lang_data[lang],
+            'voice': get_voice_mapping(lang, settings.get(f"{rank}_{lang}_voice")),
+            'speed': speed,
+            'rate': speed_to_rate(speed),
+            'repeat': settings.get(f'{rank}_repeat', 0),
+            'show_subtitle': not settings['hide_subtitles'][f'{rank}_lang'],
+            'subtitle_delay': settings['subtitle_delay'] * rank_key_to_index(rank)
+        })
+    return {
+        'settings': settings,
+        'lang_data': lang_data,
+        'ranks': ranks,
+        'total': len(next(iter(lang_data.values()), [])),
+        'speed_display': ", ".join(f"{LANG_DISPLAY.get(r['lang'], r['lang'])} {format_speed(r['speed'])}배" for r in ranks),
+        'subtitle_templates': {rank: subtitle_template(settings, rank) for rank in ('first', 'second', 'third')}
+    }
+
+# 학습 타임라인 이벤트 (불변)
+# kind: 'sentence' 문장 시작 / 'subtitle' 자막 표시 / 'speak' 음성 재생 / 'sound' 알림음 재생 / 'pause' 대기
+#       'break' 휴식 시작 / 'break_end' 휴식 끝 / 'pass_end' 한 회차 끝 / 'repeat' 다음 회차 시작 / 'end' 학습 끝
+TimelineEvent = namedtuple(
+    'TimelineEvent',
+    ['kind', 'sentence', 'number', 'pass_index', 'rank', 'text', 'voice', 'speed', 'interval', 'next_sentence', 'seconds'],
+    defaults=(None, None, 0, None, None, None, None, 0.0, False, 0.0)
+)
+
+# 컴파일된 학습 타임라인 - events: 이벤트 튜플, spans: spans[회차][문장] = (시작, 끝) 이벤트 위치
+LessonTimeline = namedtuple('LessonTimeline', ['events', 'spans', 'total', 'passes'])
+
+def compile_lesson_timeline(plan, start_idx=0):
+    """학습 계획을 재생 순서대로 펼친 불변 타임라인으로 변환 (Streamlit과 무관)
+
+    순위별 자막/반복 재생, break_interval 문장마다 휴식, 자동 반복 회차를 모두 포함
+    재생 시간에 따른 대기는 'speak'/'sound' 이벤트의 interval/next_sentence로 재생 시점에 계산
+    """
+    settings = plan['settings']
+    interval = break_interval(settings)
+    passes = lesson_pass_count(settings)
+    events, spans = [], []
+    for pass_index in range(passes):
+        pass_spans = []
+        for i in range(plan['total']):
+            start = len(events)
+            number = start_idx + i + 1
+            events.append(TimelineEvent('sentence', i, number, pass_index))
+            for entry in plan['ranks']:
+                text = entry['texts'][i]
+                if text and entry['show_subtitle']:
+                    events.append(TimelineEvent('pause', i, number, pass_index, seconds=entry['subtitle_delay']))
+                    events.append(TimelineEvent('subtitle', i, number, pass_index, entry['rank'], text))
+                if isinstance(text, str) and text.strip() and entry['voice']:
+                    speak = TimelineEvent('speak', i, number, pass_index, entry['rank'], text, entry['voice'],
+                                          entry['speed'], settings['spacing'])
+                    events.extend([speak] * entry['repeat'])
+            events.append(TimelineEvent('pause', i, number, pass_index, seconds=settings['next_sentence_time']))
+            pass_spans.append((start, len(events)))
+
+            if interval and (i + 1) % interval == 0:
+                events.append(TimelineEvent('break', i, number, pass_index))
+                if BREAK_SOUND_PATH.exists():
+                    events.append(TimelineEvent('sound', i, number, pass_index, text=str(BREAK_SOUND_PATH), next_sentence=True))
+                events.append(TimelineEvent('pause', i, number, pass_index, seconds=3))
+                events.append(TimelineEvent('speak', i, number, pass_index, text=BREAK_MESSAGE, voice=BREAK_VOICE,
+                                            speed=1.0, next_sentence=True))
+                events.append(TimelineEvent('pause', i, number, pass_index, seconds=3))
+                # 알림음과 메시지 재생 시간 + 추가 대기 시간 고려
+                events.append(TimelineEvent('pause', i, number, pass_index, seconds=max(0, settings.get('break_duration', 5) - 7)))
+                events.append(TimelineEvent('break_end', i, number, pass_index))
+        spans.append(tuple(pass_spans))
+
+        events.append(TimelineEvent('pass_end', pass_index=pass_index))
+        if FINAL_SOUND_PATH.exists():
+            events.append(TimelineEvent('sound', pass_index=pass_index, text=str(FINAL_SOUND_PATH), next_sentence=True))
+        if pass_index + 1 < passes:
+            events.append(TimelineEvent('repeat', pass_index=pass_index + 1))
+    events.append(TimelineEvent('end', pass_index=passes - 1))
+    return LessonTimeline(tuple(events), tuple(spans), plan['total'], passes)
+
+def timeline_sentence_events(timeline, index, pass_index=0):
+    """index번째 문장의 이벤트 (문장 시작 표시 다음부터 다음 문장 전 대기까지)"""
+    start, end = timeline.spans[pass_index][index]
+    return timeline.events[start + 1:end]
+
+def timeline_resume_position(timeline, index, pass_index=0):
+    """index번째 문장부터 이어서 재생할 이벤트 위치"""
+    return timeline.spans[pass_index][index][0]
+
+def timeline_speech_jobs(events):
+    """이벤트 중 합성이 필요한 (텍스트, 음성, 배속) 목록 (중복 제거, 순서 유지)"""
+    return list(dict.fromkeys((e.text, e.voice, e.speed) for e in events if e.kind == 'speak'))
+
+def timeline_track_items(events, audio_files, settings, passes=1):
+    """이벤트를 오디오 트랙 항목으로 변환 - 클립 뒤 대기 시간은 실제 재생 시간으로 계산
+
+    항목: ('silence', 초) / ('subtitle', 정보) / ('clip', 경로, 정보) / ('chapter', 제목)
+    """
+    items = []
+    for event in events:
+        if event.kind == 'pause':
+            items.append(('silence', event.seconds))
+        elif event.kind == 'subtitle':
+            items.append(('subtitle', {'rank': event.rank, 'text': event.text}))
+        elif event.kind == 'sentence':
+            title = f"No.{event.number:03d}" + (f" ({event.pass_index + 1}/{passes})" if passes > 1 else "")
+            items.append(('chapter', title))
+        elif event.kind == 'break':
+            items.append(('chapter', "휴식"))
+        elif event.kind in ('speak', 'sound'):
+            audio_file = event.text if event.kind == 'sound' else audio_files.get((event.text, event.voice, event.speed))
+            if not audio_file:
+                continue
+            duration = get_audio_duration(audio_file)
+            info = {'rank': event.rank, 'text': event.text} if event.rank else None
+            items.append(('clip', audio_file, info))
+            items.append(('silence', clip_wait_time(duration, event.interval, event.next_sentence, settings) - duration))
+    return items
+
+async def _prefetch_sentence(clips, semaphore, stats=None):
+    """한 문장의 모든 음성을 동시에 합성하여 {(텍스트, 음성, 배속): 파일 경로} 반환"""
+    async def fetch(text, voice, speed):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await get_voice_file(text, voice, speed)
+            if stats is not None:
+                stats['clip'].append(time.perf_counter() - started)
+            return result
+
+    results = await asyncio.gather(*(fetch(*clip) for clip in clips), return_exceptions=True)
+    return {clip: result for clip, result in zip(clips, results) if isinstance(result, str)}
+
+def create_prefetch_pipeline(plan, timeline):
+    """미리 생성 파이프라인 상태 생성 (문장별 합성 대상은 타임라인 첫 회차에서 추출)"""
+    settings = plan['settings']
+    return {
+        'timeline': timeline,
+        'settings': settings,
+        'total': timeline.total,
+        'depth': max(0, int(settings.get('prefetch_depth', 3))),
+        'semaphore': asyncio.Semaphore(PREFETCH_CONCURRENCY),
+        'tasks': {},
+        'tracks': {},
+        # 단계별 소요 시간(초): 클립 합성, 현재 문장 합성 대기, 문장 트랙 생성
+        'stats': {'clip': [], 'stall': [], 'track': []}
+    }
+
+def schedule_prefetch(pipeline, index):
+    """현재 문장부터 depth 문장 앞까지 합성 작업을 백그라운드로 예약"""
+    last = min(index + pipeline['depth'], pipeline['total'] - 1)
+    for j in range(index, last + 1):
+        if j not in pipeline['tasks']:
+            clips = timeline_speech_jobs(timeline_sentence_events(pipeline['timeline'], j))
+            task = asyncio.create_task(_prefetch_sentence(clips, pipeline['semaphore'], pipeline['stats']))
+            pipeline['tasks'][j] = task
+            if pipeline['settings'].get('audio_track_mode') == 'sentence':
+                # 문장 단위 트랙도 미리 합쳐 둠
+                pipeline['tracks'][j] = asyncio.create_task(_prefetch_track(pipeline, j, task))
+
+async def _prefetch_track(pipeline, index, clip_task):
+    """합성된 클립으로 문장 트랙 생성 (ffmpeg 작업은 별도 스레드에서)"""
+    clips = await clip_task
+    events = timeline_sentence_events(pipeline['timeline'], index)
+    items = timeline_track_items(events, clips, pipeline['settings'])
+    started = time.perf_counter()
+    track = await asyncio.to_thread(render_audio_track, items, track_cache_key(items))
+    pipeline['stats']['track'].append(time.perf_counter() - started)
+    return track
+
+async def take_prefetched_track(pipeline, index):
+    """index번째 문장 트랙 (경로, 자막 큐, 길이) - 트랙 모드가 아니거나 실패 시 None"""
+    task = pipeline['tracks'].pop(index, None)
+    if task is None:
+        return None
+    try:
+        return await task
+    except Exception as e:
+        st.warning(f"문장 트랙 생성 실패, 클립 재생으로 전환합니다: {e}")
+        return None
+
+async def take_prefetched(pipeline, index):
+    """index번째 문장의 합성 결과를 기다려 반환"""
+    schedule_prefetch(pipeline, index)
+    task = pipeline['tasks'].pop(index)
+    started = time.perf_counter()
+    try:
+        return await task
+    except Exception:
+        return {}
+    finally:
+        pipeline['stats']['stall'].append(time.perf_counter() - started)
+
+def cancel_prefetch(pipeline):
+    """남은 합성 작업 모두 취소 (학습 종료/반복 재시작 시)"""
+    for task in list(pipeline['tasks'].values()) + list(pipeline['tracks'].values()):
+        task.cancel()
+    pipeline['tasks'].clear()
+    pipeline['tracks'].clear()
+
+async def render_lesson_timeline(timeline, plan, pipeline, scheduler, playback,
+                                 progress, status, subtitles, word_sync, start_at=0):
+    """컴파일된 타임라인을 Streamlit 화면과 오디오로 재생 (start_at 이벤트 위치부터 이어서 재생 가능)"""
+    settings = plan['settings']
+    events = timeline.events
+    prefetched = {}
+    speech_tasks = {}  # 휴식 안내 음성처럼 재생 직전에 미리 합성해 두는 음성
+    position = start_at
+    while position < len(events):
+        event = events[position]
+        position += 1
+        kind = event.kind
+
+        if kind == 'sentence':
+            i = event.sentence
+            # 진행률 업데이트
+            progress.progress((i + 1) / timeline.total)
+
+            # 현재 문장 합성 결과 대기 + 다음 문장들 백그라운드 합성 예약
+            prefetched = await take_prefetched(pipeline, i)
+            schedule_prefetch(pipeline, i + 1)
+
+            # 앞 문장 재생이 끝난 뒤 다음 문장 번호와 배속 정보 표시
+            await wait_for_deadline(scheduler)
+            record_playback_event(scheduler, 'sentence', sentence=event.number)
+            st.session_state.lesson_position = {'lesson': plan.get('lesson'), 'pass': event.pass_index, 'sentence': i}
+            status.markdown(f'<div style="color: #00FF00;">No.{event.number:03d} ({plan["speed_display"]})</div>', unsafe_allow_html=True)
+
+            # 문장 단위 트랙 모드: 한 번에 재생하고 자막은 큐 시각에 표시한 뒤 문장 끝으로 이동
+            track = await take_prefetched_track(pipeline, i)
+            if track is not None:
+                await play_sentence_track(scheduler, track, subtitles, settings, event.number, plan)
+                position = timeline.spans[event.pass_index][i][1]
+
+        elif kind == 'pause':
+            schedule_pause(scheduler, event.seconds)
+
+        elif kind == 'subtitle':
+            if rank_key_to_index(event.rank) < len(subtitles):
+                try:
+                    # 앞 순위 음성이 끝난 뒤 자막 표시
+                    await wait_for_deadline(scheduler)
+                    record_playback_event(scheduler, 'subtitle', sentence=event.number, rank=event.rank)
+                    render_subtitle(subtitles, event.rank, event.text, settings, plan)
+                except Exception as e:
+                    st.error(f"자막 표시 오류: {str(e)}")
+
+        elif kind == 'speak':
+            job = (event.text, event.voice, event.speed)
+            try:
+                audio_file = prefetched.get(job)
+                if not audio_file and job in speech_tasks:
+                    audio_file = await speech_tasks.pop(job)
+                if not audio_file:
+                    audio_file = await get_voice_file(text=event.text, voice=event.voice, speed=event.speed)
+                if audio_file:
+                    # 재생 대기 중에도 백그라운드 합성이 진행되도록 비동기 대기
+                    await schedule_clip(scheduler, audio_file, event.interval, event.next_sentence,
+                                        sentence=event.number, rank=event.rank)
+                    # 단어 경계 시각에 맞춰 자막 강조
+                    words = get_clip_words(audio_file) if word_sync and event.rank else []
+                    if words and not settings['hide_subtitles'][f'{event.rank}_lang']:
+                        if playback['word_task'] is not None:
+                            playback['word_task'].cancel()
+                        playback['word_task'] = asyncio.create_task(sync_subtitle_words(
+                            subtitles, event.rank, event.text, words, settings, asyncio.get_running_loop().time(), plan))
+            except Exception as e:
+                lang = next((r['lang'] for r in plan['ranks'] if r['rank'] == event.rank), event.voice)
+                st.warning(f"{LANG_DISPLAY.get(lang, lang)} 음성 재생 오류: {str(e)}")
+                schedule_pause(scheduler, 1)
+
+        elif kind == 'sound':
+            if Path(event.text).exists():
+                await schedule_clip(scheduler, event.text, event.interval, event.next_sentence)
+
+        elif kind == 'break':
+            await wait_for_deadline(scheduler)
+            record_playback_event(scheduler, 'break', sentence=event.number)
+            status.warning(f"🔄 {settings['break_interval']}문장 완료! {settings['break_duration']}초간 휴식...")
+            # 휴식 안내 음성은 알림음 재생 중에 생성
+            for later in events[position:]:
+                if later.kind == 'break_end':
+                    break
+                if later.kind == 'speak':
+                    job = (later.text, later.voice, later.speed)
+                    speech_tasks.setdefault(job, asyncio.create_task(get_voice_file(*job)))
+
+        elif kind == 'break_end':
+            await wait_for_deadline(scheduler)
+            status.empty()
+
+        elif kind == 'pass_end':
+            # 학습 시간 업데이트
+            current_time = time.time()
+            time_diff = current_time - st.session_state.last_update_time
+            if time_diff >= 60:
+                st.session_state.today_total_study_time += int(time_diff / 60)
+                st.session_state.last_update_time = current_time
+                save_study_time()
+
+        elif kind == 'repeat':
+            # 반복 횟수가 남았으면 처음부터 다시 시작
+            await wait_for_deadline(scheduler)
+            status.info(f"반복 중... ({event.pass_index}/{timeline.passes})")
+
+        elif kind == 'end':
+            await wait_for_deadline(scheduler)
+            st.session_state.pop('lesson_position', None)
+            if settings['auto_repeat']:
+                # 반복 횟수를 모두 채우면 학습 종료
+                st.success(f"학습이 완료되었습니다! (총 {timeline.passes}회 반복)")
+                st.session_state.page = 'settings'
+                st.rerun()
 
 async def start_learning():
     """학습 시작"""
+    pipeline = None
+    playback = {'word_task': None}
     try:
         settings = st.session_state.settings
         
@@ -1213,235 +2892,57 @@ async def start_learning():
                     settings[voice_key] = default_voice
                     # st.warning(f"{rank.capitalize()} 언어({lang})의 음성 모델이 재설정되었습니다.")
 
-        sentence_count = 0
-        repeat_count = 0
-        
-        # 선택된 시트의 데이터 읽기
-        df = pd.read_excel(
-            EXCEL_PATH,
-            sheet_name=settings.get('selected_sheet', 0),
-            header=0,
-            engine='openpyxl'
-        )
-
+        # 선택된 시트의 데이터 (캐시)
         start_idx = settings['start_row'] - 1
         end_idx = settings['end_row'] - 1
 
-        # 열 이름 매핑
-        column_mapping = {
-            'english': 'en-미국',
-            'korean': 'ko-한국',
-            'chinese': 'zh-중국',
-            'japanese': 'ja-일본',
-            'vietnamese': 'vi-베트남',
-            'thai': 'th-태국',
-            'filipino': 'tl-필리핀',
-            'russian': 'ru-러시아',
-            'uzbek': 'uz-우즈벡',
-            'mongolian': 'mn-몽골',
-            'nepali': 'ne-네팔',
-            'burmese': 'my-미얀마',
-            'indonesian': 'id-인니',
-            'khmer': 'km-캄보디아',
-            'hindi': 'hi-인도'
-        }
+        # 선택된 언어 열과 학습 범위만 로드
+        languages = [settings[key] for key in ('first_lang', 'second_lang', 'third_lang') if settings[key] != 'none']
+        lang_data = load_sheet_range(settings.get('selected_sheet', 0), languages, start_idx, end_idx)
 
-        # 언어별 데이터 저장
-        lang_data = {}
-        for lang, col in column_mapping.items():
-            lang_data[lang] = df[col].iloc[start_idx:end_idx+1].tolist()
+        # 순위별 음성/배속/자막 조각은 한 번만 계산하고 학습 흐름 전체를 타임라인으로 컴파일
+        plan = build_session_plan(settings, lang_data)
+        timeline = compile_lesson_timeline(plan, start_idx)
 
-        total_sentences = len(lang_data['english'])
+        # 같은 학습(시트/범위/타임라인 구성)을 재실행하면 마지막으로 재생하던 문장부터 이어서 재생
+        plan['lesson'] = (settings.get('selected_sheet', 0), start_idx, end_idx, len(timeline.events), timeline.passes)
+        start_at = 0
+        saved = st.session_state.get('lesson_position')
+        if saved and saved.get('lesson') == plan['lesson']:
+            start_at = timeline_resume_position(timeline, saved['sentence'], saved['pass'])
 
         # 학습 UI 생성
         progress, status, subtitles, speed_info = create_learning_ui()
 
-        # 학습 반복 처리
-        while True:
-            for i in range(total_sentences):
-                # 진행률 업데이트
-                progress.progress((i + 1) / total_sentences)
+        # 미리 생성 파이프라인 (현재 문장 재생 중 다음 문장 합성)
+        pipeline = create_prefetch_pipeline(plan, timeline)
 
-                # 현재 문장 번호와 배속 정보 표시
-                sentence_number = start_idx + i + 1
-                speed_display = []
-                
-                # 각 순위별 처리
-                for rank, lang_key in [('first', 'first_lang'), ('second', 'second_lang'), ('third', 'third_lang')]:
-                    lang = settings[lang_key]
-                    if lang != 'none' and lang in lang_data:
-                        # 배속 정보 표시
-                        speed_key = f"{rank}_{lang}_speed"
-                        speed = settings.get(speed_key, 1.2)
-                        speed_text = str(int(speed)) if speed.is_integer() else f"{speed:.1f}"
-                        speed_display.append(f"{LANG_DISPLAY.get(lang, lang)} {speed_text}배")
-
-                status.markdown(f'<div style="color: #00FF00;">No.{sentence_number:03d} ({", ".join(speed_display)})</div>', unsafe_allow_html=True)
-
-                # 각 순위별 처리
-                for rank, lang_key in [('first', 'first_lang'), ('second', 'second_lang'), ('third', 'third_lang')]:
-                    lang = settings[lang_key]
-                    repeat = settings.get(f'{rank}_repeat', 0)
-                    
-                    if lang != 'none' and lang in lang_data:
-                        # 현재 문장 가져오기
-                        text = lang_data[lang][i]
-                        
-                        # 자막 표시
-                        if not settings['hide_subtitles'][f'{rank}_lang']:
-                            if text and rank_key_to_index(rank) < len(subtitles):
-                                try:
-                                    await asyncio.sleep(settings['subtitle_delay'] * rank_key_to_index(rank))
-                                    font_size = settings.get(f'{rank}_font_size', 22)
-                                    color = settings.get(f'{rank}_color', '#00FF00')
-                                    
-                                    # 3번째 자막일 경우 모든 재생되는 음성 모델 표시
-                                    if rank_key_to_index(rank) == 2:  # 3번째 자막
-                                        # 재생되는 모든 음성 모델 수집
-                                        voice_models = []
-                                        for r, l_key in [('first', 'first_lang'), ('second', 'second_lang'), ('third', 'third_lang')]:
-                                            l = settings[l_key]
-                                            if l != 'none' and settings.get(f'{r}_repeat', 0) > 0:
-                                                voice_name = settings.get(f"{r}_{l}_voice", "")
-                                                if voice_name:
-                                                    voice_models.append(f"{voice_name}")
-                                        
-                                        voice_info = " | ".join(voice_models) if voice_models else ""
-                                        
-                                        subtitles[rank_key_to_index(rank)].markdown(
-                                            f"""
-                                            <div class="{rank}-text" 
-                                                 style="font-size: {font_size}px !important; color: {color};">
-                                                {text}
-                                                <br/>
-                                                <div style="font-size: {max(10, font_size//4)}px !important; color: #808080; opacity: 0.8;">
-                                                    {voice_info}
-                                                </div>
-                                            </div>
-                                            """,
-                                            unsafe_allow_html=True
-                                        )
-                                    else:
-                                        # 1, 2번째 자막은 텍스트만 표시
-                                        subtitles[rank_key_to_index(rank)].markdown(
-                                            f"""
-                                            <div class="{rank}-text" 
-                                                 style="font-size: {font_size}px !important; color: {color};">
-                                                {text}
-                                            </div>
-                                            """,
-                                            unsafe_allow_html=True
-                                        )
-                                except Exception as e:
-                                    st.error(f"자막 표시 오류: {str(e)}")
-                                    continue
-
-                        # 음성 재생
-                        if repeat > 0:
-                            speed_key = f"{rank}_{lang}_speed"
-                            speed = settings.get(speed_key, 1.2)
-                            
-                            for _ in range(repeat):
-                                try:
-                                    audio_file = await get_voice_file(
-                                        text=text,
-                                        voice=get_voice_mapping(lang, settings.get(f"{rank}_{lang}_voice")),
-                                        speed=speed
-                                    )
-                                    if audio_file:
-                                        play_audio(audio_file, settings['spacing'], False)
-                                except Exception as e:
-                                    st.warning(f"{LANG_DISPLAY.get(lang, lang)} 음성 재생 오류: {str(e)}")
-                                    await asyncio.sleep(1)
-                                    continue
-
-                # 다음 문장으로 넘어가기 전 대기
-                await asyncio.sleep(settings['next_sentence_time'])
-
-                # 브레이크 체크
-                sentence_count += 1
-                if settings['break_enabled'] and sentence_count % settings['break_interval'] == 0:
-                    try:
-                        status.warning(f"🔄 {settings['break_interval']}문장 완료! {settings['break_duration']}초간 휴식...")
-                        
-                        # 1. 먼저 break.wav 알림음 재생
-                        break_sound_path = SCRIPT_DIR / 'base/break.wav'
-                        if break_sound_path.exists():
-                            play_audio(str(break_sound_path), 0, True)
-                        
-                        # 2. 브레이크 음성 메시지 생성 및 재생
-                        break_msg = "쉬어가는 시간입니다, 5초간의 호흡을 느껴보세요"
-                        break_audio = await get_voice_file(break_msg, VOICE_MAPPING['korean']['선희'], 1.0)
-                        time.sleep(3)  # 첫 번째 대기
-                        if break_audio:
-                            play_audio(break_audio, 0, True)
-                            time.sleep(3)  # 브레이크 메시지 재생 후 추가 3초 대기
-                        
-                        # 3. 남은 휴식 시간 대기
-                        remaining_time = max(0, settings['break_duration'] - 7)  # 알림음과 메시지 재생 시간 + 추가 대기 시간 고려
-                        if remaining_time > 0:
-                            await asyncio.sleep(remaining_time)
-                        
-                        status.empty()
-                        
-                    except Exception as e:
-                        st.error(f"브레이크 처리 중 오류: {e}")
-                        traceback.print_exc()
-
-            # 학습 완료 시
-            try:
-                # 마지막 시간 업데이트
-                current_time = time.time()
-                time_diff = current_time - st.session_state.last_update_time
-                if time_diff >= 60:
-                    minutes_to_add = int(time_diff / 60)
-                    st.session_state.today_total_study_time += minutes_to_add
-                    st.session_state.last_update_time = current_time
-                    # 학습 시간 저장
-                    save_study_time()
-                
-                # final.wav 재생
-                final_sound_path = SCRIPT_DIR / 'base/final.wav'
-                if final_sound_path.exists():
-                    play_audio(str(final_sound_path), 0, True)
-                
-                if settings['auto_repeat']:
-                    repeat_count += 1
-                    if repeat_count < settings['repeat_count']:
-                        # 반복 횟수가 남았으면 처음부터 다시 시작
-                        sentence_count = 0
-                        status.info(f"반복 중... ({repeat_count}/{settings['repeat_count']})")
-                        continue
-                    else:
-                        # 반복 횟수를 모두 채우면 학습 종료
-                        st.success(f"학습이 완료되었습니다! (총 {settings['repeat_count']}회 반복)")
-                        st.session_state.page = 'settings'
-                        st.rerun()
-                break  # 반복이 필요 없으면 루프 종료
+        # 재생 스케줄러 (time.sleep 대신 마감 시각까지 비동기 대기)
+        scheduler = create_playback_scheduler()
+        st.session_state.playback_timeline = scheduler['timeline']
 
-            except Exception as e:
-                st.error(f"완료 알림음 재생 오류: {e}")
-                traceback.print_exc()
-                break  # 오류 발생 시 루프 종료
+        # 단어 단위 자막 강조 (edge-tts 단어 경계 시각 사용)
+        word_sync = settings.get('subtitle_word_sync', False) and len(subtitles) == 3
+
+        await render_lesson_timeline(timeline, plan, pipeline, scheduler, playback,
+                                     progress, status, subtitles, word_sync, start_at)
 
     except Exception as e:
         st.error(f"학습 중 오류 발생: {str(e)}")
         traceback.print_exc()
+    finally:
+        # 학습 종료/화면 전환 시 남은 합성 작업 취소
+        if pipeline is not None:
+            cancel_prefetch(pipeline)
+        if playback['word_task'] is not None:
+            playback['word_task'].cancel()
 
 def get_column_data(df, column_name, start_idx, end_idx):
-    """메모리 효율적인 데이터 로드"""
+    """메모리 효율적인 데이터 로드 - df 대신 시트 이름/번호를 주면 캐시된 시트에서 범위만 추출"""
     try:
-        if column_name in df.columns:
-            # 청크 단위로 데이터 로드 (메모리 사용량 감소)
-            chunk_size = 100
-            result = []
-            for chunk_start in range(start_idx, end_idx + 1, chunk_size):
-                chunk_end = min(chunk_start + chunk_size, end_idx + 1)
-                chunk = df.loc[chunk_start:chunk_end-1, column_name].tolist()
-                result.extend(chunk)
-            return result
-        else:
-            return [""] * (end_idx - start_idx + 1)
+        if not isinstance(df, pd.DataFrame):
+            df = get_sheet(df)
+        return project_sheet_columns(df, [column_name], start_idx, end_idx)[column_name]
     except Exception as e:
         st.warning(f"{column_name} 열 읽기 실패: {str(e)}")
         return [""] * (end_idx - start_idx + 1)
@@ -1518,6 +3019,7 @@ def main():
     """, unsafe_allow_html=True)
     
     initialize_session_state()
+    start_metrics_writer()
     
     if st.session_state.page == 'settings':
         create_settings_ui()
@@ -1525,6 +3027,10 @@ def main():
         asyncio.run(start_learning())
     elif st.session_state.page == 'settings_from_learning':
         create_settings_ui(return_to_learning=True)
+
+    # 설정 화면에서 바뀐 값 저장 (내용이 같으면 생략, 연속 변경은 모아서 한 번에 기록)
+    if st.session_state.page in ('settings', 'settings_from_learning'):
+        save_settings(st.session_state.settings)
         
     # 하단 문구 추가
     st.markdown("""
@@ -1533,13 +3039,130 @@ def main():
         </div>
     """, unsafe_allow_html=True)
 
-def save_settings(settings):
-    """설정값을 파일에 저장"""
+# 설정 파일별 마지막 기록 내용의 해시와 대기 중인 기록 (같은 내용이면 다시 쓰지 않음)
+_settings_files = {}  # 경로 -> 마지막으로 기록한 내용의 해시
+_settings_pending = {}  # 경로 -> {'data': 기록할 내용, 'timer': threading.Timer}
+_settings_lock = threading.Lock()
+
+def _query_param(name):
+    """URL 쿼리 매개변수 값 (streamlit 버전별 API 차이 처리)"""
+    if hasattr(st, 'query_params'):
+        return st.query_params.get(name)
+    values = st.experimental_get_query_params().get(name)
+    return values[0] if values else None
+
+def _set_query_param(name, value):
+    """URL 쿼리 매개변수 설정 (새로고침/북마크 후에도 유지)"""
+    if hasattr(st, 'query_params'):
+        st.query_params[name] = value
+    else:
+        params = st.experimental_get_query_params()
+        params[name] = value
+        st.experimental_set_query_params(**params)
+
+def settings_user_id(create=False):
+    """세션의 설정 사용자 ID (URL의 ?user= 값) - 없으면 None, create=True이면 새로 만들어 URL에 기록"""
+    user_id = st.session_state.get('settings_user')
+    if user_id is None:
+        user_id = ''.join(c for c in str(_query_param('user') or '') if c.isalnum() or c in '-_')[:64] or None
+        if user_id is None and create:
+            user_id = uuid.uuid4().hex[:12]
+            try:
+                _set_query_param('user', user_id)
+            except Exception:
+                pass  # 화면 없이 실행 중이면 URL 없음
+        if user_id is not None:
+            st.session_state.settings_user = user_id
+    return user_id
+
+def user_settings_path(user_id):
+    """사용자별 설정 파일 경로 (사용자 ID가 없으면 공용 설정 파일)"""
+    return USER_SETTINGS_DIR / f'{user_id}.json' if user_id else SETTINGS_PATH
+
+def _write_settings_file(path, data):
+    """설정 파일을 임시 파일에 쓴 뒤 교체 (읽는 쪽이 반쯤 쓴 파일을 보지 않도록)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.{uuid.uuid4().hex}.tmp')
     try:
-        with open(SETTINGS_PATH, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        st.error(f"설정 저장 중 오류: {e}")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+def _flush_settings_file(path):
+    """대기 중인 설정 기록 실행 (타이머 스레드 또는 flush_settings에서 호출)"""
+    with _settings_lock:
+        pending = _settings_pending.pop(path, None)
+    if pending is None:
+        return
+    try:
+        _write_settings_file(path, pending['data'])
+        with _settings_lock:
+            _settings_files[path] = hashlib.sha256(pending['data']).hexdigest()
+    except Exception:
+        traceback.print_exc()
+
+def flush_settings():
+    """대기 중인 모든 설정 기록을 즉시 실행 (프로세스 종료 시에도 호출)"""
+    with _settings_lock:
+        paths = list(_settings_pending)
+        for path in paths:
+            _settings_pending[path]['timer'].cancel()
+    for path in paths:
+        _flush_settings_file(path)
+
+atexit.register(flush_settings)
+
+def cleanup_user_settings(max_age_days=USER_SETTINGS_RETENTION_DAYS):
+    """오래 사용하지 않은 사용자 설정 파일과 남은 임시 파일 삭제 - 삭제한 파일 수 반환"""
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for path in list(USER_SETTINGS_DIR.glob('*.json')) + list(USER_SETTINGS_DIR.glob('*.tmp')):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+def _matches_shared_settings(settings):
+    """공용 설정(기본값 포함)에서 바뀐 값이 없는지 확인"""
+    return all(settings.get(key) == value for key, value in get_shared_settings().items())
+
+def save_settings(settings, user_id=None, delay=None):
+    """설정값을 사용자별 파일에 저장 예약 - 기록된 내용과 같으면 생략, 연속 변경은 delay초 후 한 번만 기록
+
+    공용 설정에서 바뀐 값이 없으면 사용자 파일을 만들지 않고, 처음 바뀌었을 때 사용자 ID를 만들어 URL에 기록
+    기록이 예약되었으면 True
+    """
+    if user_id is None:
+        user_id = settings_user_id()
+    if user_id is None or not (user_settings_path(user_id).exists() or user_settings_path(user_id) in _settings_pending):
+        if _matches_shared_settings(settings):
+            return False
+        if user_id is None:
+            user_id = settings_user_id(create=True)
+    path = user_settings_path(user_id)
+    data = json.dumps(settings, ensure_ascii=False, indent=2).encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()
+    with _settings_lock:
+        if path not in _settings_files:
+            try:
+                _settings_files[path] = hashlib.sha256(path.read_bytes()).hexdigest()
+            except OSError:
+                _settings_files[path] = None
+        pending = _settings_pending.get(path)
+        if pending is not None:
+            pending['timer'].cancel()
+        elif digest == _settings_files[path]:
+            return False
+        timer = threading.Timer(SETTINGS_SAVE_DEBOUNCE if delay is None else delay, _flush_settings_file, args=(path,))
+        timer.name = 'settings-writer'
+        timer.daemon = True  # 종료 시 기다리지 않고 atexit의 flush_settings가 바로 기록
+        _settings_pending[path] = {'data': data, 'timer': timer}
+        timer.start()
+    return True
 
 def save_study_time():
     """학습 시간을 파일에 저장"""
@@ -1678,5 +3301,689 @@ def rank_key_to_index(rank):
     rank_mapping = {'first': 0, 'second': 1, 'third': 2}
     return rank_mapping.get(rank, 0)
 
+@st.cache_data(max_entries=2, show_spinner=False)
+def _load_shared_settings(mtime_ns):
+    """공용 설정 파일을 수정 시각당 한 번만 읽기 (누락된 값은 기본값으로 보완)"""
+    settings = copy.deepcopy(DEFAULT_SETTINGS)
+    try:
+        settings.update(json.loads(SETTINGS_PATH.read_bytes()))
+    except Exception:
+        pass
+    return settings
+
+def get_shared_settings():
+    """캐시된 공용 설정 (호출마다 복사본 반환)"""
+    try:
+        mtime_ns = SETTINGS_PATH.stat().st_mtime_ns
+    except OSError:
+        mtime_ns = 0
+    return _load_shared_settings(mtime_ns)
+
+def load_saved_settings(user_id=None):
+    """저장된 설정 파일 로드 (누락된 값은 기본값으로 보완)
+
+    사용자 설정 파일이 없으면 공용 설정 파일을 초기값으로 사용
+    """
+    if user_id:
+        path = user_settings_path(user_id)
+        with _settings_lock:
+            pending = _settings_pending.get(path)
+        try:
+            # 아직 기록 대기 중인 내용이 있으면 그것이 최신
+            settings = copy.deepcopy(DEFAULT_SETTINGS)
+            settings.update(json.loads(pending['data']) if pending else json.loads(path.read_bytes()))
+            return settings
+        except Exception:
+            pass
+    return get_shared_settings()
+
+def resolve_voice_id(language, voice):
+    """음성 표시 이름 또는 음성 ID를 edge-tts 음성 ID로 변환"""
+    voices = VOICE_MAPPING.get(language, {})
+    if voice in voices.values():
+        return voice
+    if voice in voices:
+        return voices[voice]
+    return next(iter(voices.values()), None)
+
+def collect_prerender_jobs(settings, lang_data, languages=None, voices=None, speeds=None):
+    """미리 생성할 (텍스트, 음성 ID, 배속) 작업 목록 - 중복 제거"""
+    combos = []
+    if languages:
+        # 명령줄에서 지정한 언어 × 음성 × 배속 조합
+        for lang in languages:
+            lang_voices = voices or [settings.get(f"{lang}_voice") or next(iter(VOICE_MAPPING[lang]))]
+            for voice in lang_voices:
+                for speed in speeds or [settings.get(f"{lang}_speed", 1.2)]:
+                    combos.append((lang, resolve_voice_id(lang, voice), float(speed)))
+    else:
+        # 저장된 설정의 1~3순위 언어/음성/배속
+        for rank in ['first', 'second', 'third']:
+            lang = settings.get(f'{rank}_lang', 'none')
+            if lang == 'none' or lang not in VOICE_MAPPING or settings.get(f'{rank}_repeat', 1) <= 0:
+                continue
+            voice = settings.get(f"{rank}_{lang}_voice")
+            speed = settings.get(f"{rank}_{lang}_speed", 1.2)
+            combos.append((lang, resolve_voice_id(lang, voice), float(speed)))
+
+    jobs = {}  # (정규화 문장, 음성, 배속) -> (원문, 음성, 배속): 캐시 키가 같은 작업은 한 번만
+    for lang, voice, speed in combos:
+        for text in map(cell_text, lang_data.get(lang, [])):
+            if normalize_text(text):
+                jobs.setdefault((normalize_text(text), voice, speed), (text, voice, speed))
+    jobs.setdefault((BREAK_MESSAGE, BREAK_VOICE, 1.0), (BREAK_MESSAGE, BREAK_VOICE, 1.0))
+    return list(jobs.values())
+
+async def prerender_clips(jobs, concurrency=4, progress_every=50):
+    """작업 목록을 제한된 동시성으로 합성하여 캐시를 채움 (이미 캐시된 항목은 건너뜀, 재시도는 합성 클라이언트가 담당)"""
+    semaphore = asyncio.Semaphore(concurrency)
+    report = {'total': len(jobs), 'synthesized': 0, 'skipped': 0, 'failed': 0, 'bytes': 0, 'errors': []}
+    started = time.time()
+
+    async def render(text, voice, speed):
+        if is_tts_cached(text, voice, speed):
+            report['skipped'] += 1
+            return
+        async with semaphore:
+            try:
+                path = await synthesize_to_cache(text, voice, speed)
+                report['synthesized'] += 1
+                report['bytes'] += path.stat().st_size
+            except Exception as e:
+                report['failed'] += 1
+                report['errors'].append(f"{voice} {speed}x '{text[:30]}': {e}")
+
+    pending = [asyncio.create_task(render(*job)) for job in jobs]
+    for done_count, task in enumerate(asyncio.as_completed(pending), start=1):
+        await task
+        if done_count % progress_every == 0:
+            print(f"  {done_count}/{len(jobs)} 완료", flush=True)
+
+    report['elapsed'] = time.time() - started
+    return report
+
+def print_prerender_report(report):
+    """미리 생성 처리량 보고서 출력"""
+    elapsed = max(report['elapsed'], 1e-9)
+    print(f"전체 {report['total']}개: 합성 {report['synthesized']}, 캐시 {report['skipped']}, 실패 {report['failed']}")
+    print(f"소요 {report['elapsed']:.1f}초, {report['synthesized'] / elapsed:.2f} clips/s, "
+          f"{report['bytes'] / 1024 / 1024:.2f} MB ({report['bytes'] / elapsed / 1024:.1f} KB/s)")
+    print(f"합성 클라이언트: 요청 {TTS_CLIENT_STATS['requests']}, 병합 {TTS_CLIENT_STATS['coalesced']}, "
+          f"재시도 {TTS_CLIENT_STATS['retries']}, 실패 {TTS_CLIENT_STATS['failures']}")
+    for error in report['errors'][:20]:
+        print(f"  실패: {error}")
+
+def run_prerender_cli(argv):
+    """명령줄: 시트/행 범위의 음성을 미리 생성하여 TTS 캐시를 채움
+
+    python en600_st_pro.py prerender --sheet 영어회화600 --start-row 1 --end-row 100
+    """
+    global TTS_MAX_RETRIES, TTS_BACKEND
+    parser = argparse.ArgumentParser(prog='en600_st_pro.py prerender', description='TTS 캐시 미리 생성')
+    parser.add_argument('--sheet', help='시트 이름 또는 번호 (기본값: 저장된 설정)')
+    parser.add_argument('--user', help='설정을 불러올 사용자 ID (기본값: 공용 설정 파일)')
+    parser.add_argument('--start-row', type=int, help='시작 행 (1부터)')
+    parser.add_argument('--end-row', type=int, help='종료 행')
+    parser.add_argument('--all-sheets', action='store_true', help='모든 시트의 고유 문장 전체 (시트/행 범위 무시)')
+    parser.add_argument('--langs', help='언어 목록 (쉼표 구분, 기본값: 저장된 1~3순위 언어)')
+    parser.add_argument('--voices', help='음성 이름/ID 목록 (쉼표 구분)')
+    parser.add_argument('--speeds', help='배속 목록 (쉼표 구분)')
+    parser.add_argument('--concurrency', type=int, default=4, help='동시 합성 개수')
+    parser.add_argument('--retries', type=int, default=3, help='실패 시 재시도 횟수')
+    parser.add_argument('--backend', choices=list(TTS_BACKENDS), default=TTS_BACKEND, help='음성 합성 엔진')
+    args = parser.parse_args(argv)
+
+    settings = load_saved_settings(args.user)
+    sheet = args.sheet if args.sheet is not None else settings.get('selected_sheet', 0)
+    if isinstance(sheet, str) and sheet.isdigit():
+        sheet = int(sheet)
+    start_row = args.start_row or settings.get('start_row', 1)
+    end_row = args.end_row or settings.get('end_row', 20)
+    languages = [lang.strip() for lang in args.langs.split(',')] if args.langs else None
+    for lang in languages or []:
+        if lang not in VOICE_MAPPING:
+            parser.error(f"알 수 없는 언어: {lang}")
+    voices = [v.strip() for v in args.voices.split(',')] if args.voices else None
+    speeds = [float(v) for v in args.speeds.split(',')] if args.speeds else None
+
+    needed = languages or [settings.get(f'{rank}_lang', 'none') for rank in ['first', 'second', 'third']]
+    if args.all_sheets:
+        # 여러 시트에 반복되는 문장은 한 번만 합성
+        dedup_index = get_text_dedup_index()
+        lang_data = {lang: [item['text'] for item in dedup_index.get(lang, {}).values()] for lang in dict.fromkeys(needed) if lang in COLUMN_MAPPING}
+        for lang, stats in text_dedup_stats({lang: dedup_index[lang] for lang in lang_data if lang in dedup_index}).items():
+            print(f"  {LANG_DISPLAY.get(lang, lang)}: 전체 {stats['cells']}문장 중 고유 {stats['unique']}문장")
+        scope = "모든 시트"
+    else:
+        lang_data = load_sheet_range(sheet, needed, start_row - 1, end_row - 1)
+        scope = f"시트 {sheet}, {start_row}~{end_row}행"
+    jobs = collect_prerender_jobs(settings, lang_data, languages, voices, speeds)
+    print(f"{scope}: {len(jobs)}개 음성 미리 생성 (캐시: {TTS_CACHE_DIR})")
+
+    TTS_MAX_RETRIES = args.retries
+    TTS_BACKEND = args.backend
+    report = asyncio.run(prerender_clips(jobs, args.concurrency))
+    print_prerender_report(report)
+    return 1 if report['failed'] else 0
+
+def run_build_sidecar_cli(argv):
+    """명령줄: 엑셀을 변환 캐시 파일로 미리 변환
+
+    python en600_st_pro.py build-sidecar
+    """
+    parser = argparse.ArgumentParser(prog='en600_st_pro.py build-sidecar', description='엑셀 변환 캐시 생성')
+    parser.parse_args(argv)
+
+    mtime_ns, size = _workbook_signature()
+    started = time.time()
+    workbook = _parse_workbook(str(EXCEL_PATH))
+    parsed = time.time()
+    if not write_sheets_sidecar(workbook, mtime_ns, size):
+        print("변환 캐시 저장 실패")
+        return 1
+    written = time.time()
+    loaded = load_sheets_sidecar(mtime_ns, size)
+    finished = time.time()
+    if loaded is None:
+        print("변환 캐시 검증 실패")
+        return 1
+    print(f"{SHEETS_SIDECAR_PATH.name}: 시트 {len(loaded['sheet_names'])}개, "
+          f"{SHEETS_SIDECAR_PATH.stat().st_size / 1024:.0f} KB")
+    print(f"엑셀 파싱 {parsed - started:.3f}초 -> 변환 캐시 로드 {finished - written:.3f}초")
+    # 설정 화면용 시트 정보도 함께 생성
+    index = build_sheet_index(loaded)
+    if not write_sheet_index_file(index, mtime_ns, size):
+        print("시트 정보 저장 실패")
+        return 1
+    for name in index['sheet_names']:
+        sheet = index['sheets'][name]
+        print(f"  {name}: {sheet['rows']}행, 언어 {len(sheet['languages'])}개")
+    return 0
+
+def lesson_pass_count(settings):
+    """자동 반복 설정에 따른 전체 반복 횟수"""
+    if settings.get('auto_repeat') and str(settings.get('repeat_count', '')).isdigit():
+        return max(1, int(settings['repeat_count']))
+    return 1
+
+def break_interval(settings):
+    """브레이크 간격(문장) - 사용하지 않으면 0"""
+    interval = settings.get('break_interval', 10)
+    if not settings.get('break_enabled', True) or not str(interval).isdigit():
+        return 0
+    return int(interval)
+
+def lesson_export_items(timeline, settings, audio_files):
+    """학습 타임라인 전체(순위/반복/브레이크/자동 반복)를 트랙 항목 목록으로 변환
+
+    ('chapter', 제목) 항목은 챕터 시작 위치를 표시
+    """
+    return timeline_track_items(timeline.events, audio_files, settings, timeline.passes)
+
+def write_track_items_wav(items, wav_path, decoded_cache_size=32):
+    """트랙 항목을 WAV 파일로 순차 기록 (클립 단위로 디코딩하여 메모리 사용량 제한)
+
+    반환: (자막 큐 목록, 챕터 목록, 길이(초))
+    """
+    decoded = {}
+    cues, chapters = [], []
+    open_subtitles = []
+    written = 0  # 기록한 샘플 수
+    silence_chunk = bytes(TRACK_FRAME_RATE * 2)  # 1초 무음
+
+    def position():
+        return written / TRACK_FRAME_RATE
+
+    with wave.open(str(wav_path), 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(TRACK_FRAME_RATE)
+        for item in items:
+            kind = item[0]
+            if kind == 'silence':
+                samples = int(round(max(0, item[1]) * TRACK_FRAME_RATE))
+                written += samples
+                while samples > 0:
+                    chunk = min(samples, TRACK_FRAME_RATE)
+                    out.writeframes(silence_chunk[:chunk * 2])
+                    samples -= chunk
+            elif kind == 'chapter':
+                # 새 챕터가 시작되면 이전 문장 자막 종료
+                for cue in open_subtitles:
+                    cue['end'] = position()
+                open_subtitles = []
+                if chapters:
+                    chapters[-1]['end'] = position()
+                chapters.append({'title': item[1], 'start': position()})
+            elif kind == 'subtitle':
+                cue = dict(item[1], kind='subtitle', start=position())
+                cues.append(cue)
+                open_subtitles.append(cue)
+            elif kind == 'clip':
+                pcm = decoded.pop(item[1], None)
+                if pcm is None:
+                    with open(item[1], 'rb') as f:
+                        segment = decode_audio(f.read())
+                    pcm = segment.set_frame_rate(TRACK_FRAME_RATE).set_channels(1).set_sample_width(2).raw_data
+                decoded[item[1]] = pcm
+                if len(decoded) > decoded_cache_size:
+                    del decoded[next(iter(decoded))]
+                start = position()
+                out.writeframes(pcm)
+                written += len(pcm) // 2
+                if item[2]:
+                    cues.append(dict(item[2], kind='speak', start=start, end=position(),
+                                     words=clip_word_times(item[1], start)))
+
+    duration = position()
+    for cue in open_subtitles:
+        cue['end'] = duration
+    if chapters:
+        chapters[-1]['end'] = duration
+    return cues, chapters, duration
+
+def format_timestamp(seconds, separator=','):
+    """자막 시각 문자열 (SRT: 00:00:01,000 / WebVTT: 00:00:01.000)"""
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+def format_srt(cues):
+    """자막 큐 목록을 SRT 문자열로 변환"""
+    blocks = []
+    for number, cue in enumerate(cues, start=1):
+        blocks.append(f"{number}\n{format_timestamp(cue['start'])} --> {format_timestamp(cue['end'])}\n{cue['text']}\n")
+    return "\n".join(blocks)
+
+def format_webvtt(cues):
+    """자막 큐 목록을 WebVTT 문자열로 변환"""
+    blocks = ["WEBVTT\n"]
+    for cue in cues:
+        blocks.append(f"{format_timestamp(cue['start'], '.')} --> {format_timestamp(cue['end'], '.')}\n{cue['text']}\n")
+    return "\n".join(blocks)
+
+def write_ffmetadata(chapters, path, title):
+    """ffmpeg 챕터 메타데이터 파일 작성"""
+    def escape(value):
+        return ''.join('\\' + ch if ch in '=;#\\\n' else ch for ch in str(value))
+
+    lines = [';FFMETADATA1', f"title={escape(title)}"]
+    for chapter in chapters:
+        lines += [
+            '[CHAPTER]',
+            'TIMEBASE=1/1000',
+            f"START={int(chapter['start'] * 1000)}",
+            f"END={int(chapter['end'] * 1000)}",
+            f"title={escape(chapter['title'])}"
+        ]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def encode_lesson_audio(wav_path, metadata_path, output_path, bitrate='64k'):
+    """ffmpeg로 WAV를 MP3/M4A로 압축하고 챕터 메타데이터 삽입"""
+    codec = ['-c:a', 'aac'] if output_path.suffix.lower() in ('.m4a', '.mp4') else ['-c:a', 'libmp3lame', '-id3v2_version', '3']
+    command = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-i', str(wav_path), '-i', str(metadata_path),
+        '-map', '0:a', '-map_metadata', '1', '-map_chapters', '1',
+        *codec, '-b:a', bitrate, str(output_path)
+    ]
+    subprocess.run(command, check=True)
+
+async def synthesize_lesson_clips(timeline, concurrency=4):
+    """내보내기에 필요한 모든 음성을 TTS 캐시에서 가져오거나 합성"""
+    jobs = timeline_speech_jobs(timeline.events)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(text, voice, speed):
+        async with semaphore:
+            return str(await synthesize_to_cache(text, voice, speed))
+
+    results = await asyncio.gather(*(fetch(*job) for job in jobs), return_exceptions=True)
+    audio_files = {job: result for job, result in zip(jobs, results) if isinstance(result, str)}
+    failed = [job for job, result in zip(jobs, results) if isinstance(result, Exception)]
+    return audio_files, failed
+
+def run_export_cli(argv):
+    """명령줄: 학습 흐름 전체를 하나의 오디오 파일(챕터 포함)과 자막 파일로 내보내기
+
+    python en600_st_pro.py export --output lesson1.mp3 --start-row 1 --end-row 20
+    """
+    global TTS_BACKEND
+    parser = argparse.ArgumentParser(prog='en600_st_pro.py export', description='학습 오디오 내보내기')
+    parser.add_argument('--output', required=True, help='출력 파일 (.mp3, .m4a 또는 .wav)')
+    parser.add_argument('--sheet', help='시트 이름 또는 번호 (기본값: 저장된 설정)')
+    parser.add_argument('--user', help='설정을 불러올 사용자 ID (기본값: 공용 설정 파일)')
+    parser.add_argument('--start-row', type=int, help='시작 행 (1부터)')
+    parser.add_argument('--end-row', type=int, help='종료 행')
+    parser.add_argument('--bitrate', default='64k', help='압축 비트레이트')
+    parser.add_argument('--concurrency', type=int, default=4, help='동시 합성 개수')
+    parser.add_argument('--subtitle-mode', choices=['sentence', 'word'], default='sentence',
+                        help='sentence: 문장 자막, word: 단어 경계 기준 구 단위 자막')
+    parser.add_argument('--backend', choices=list(TTS_BACKENDS), default=TTS_BACKEND, help='음성 합성 엔진')
+    args = parser.parse_args(argv)
+    TTS_BACKEND = args.backend
+
+    settings = load_saved_settings(args.user)
+    sheet = args.sheet if args.sheet is not None else settings.get('selected_sheet', 0)
+    if isinstance(sheet, str) and sheet.isdigit():
+        sheet = int(sheet)
+    start_row = args.start_row or settings.get('start_row', 1)
+    end_row = args.end_row or settings.get('end_row', 20)
+    output_path = Path(args.output)
+    if output_path.suffix.lower() not in ('.mp3', '.m4a', '.mp4', '.wav'):
+        parser.error("출력 파일은 .mp3, .m4a 또는 .wav 이어야 합니다")
+    # 합성 전에 출력 폴더를 만들어 두어 긴 합성 후 저장 단계에서 실패하지 않도록 함
+    try:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        parser.error(f"출력 폴더를 만들 수 없습니다: {e}")
+
+    languages = [settings[key] for key in ('first_lang', 'second_lang', 'third_lang') if settings.get(key, 'none') != 'none']
+    lang_data = load_sheet_range(sheet, languages, start_row - 1, end_row - 1)
+    started = time.time()
+    timeline = compile_lesson_timeline(build_session_plan(settings, lang_data), start_row - 1)
+    audio_files, failed = asyncio.run(synthesize_lesson_clips(timeline, args.concurrency))
+    if failed:
+        print(f"음성 {len(failed)}개 합성 실패 - 해당 음성은 빠진 채로 내보냅니다")
+
+    items = lesson_export_items(timeline, settings, audio_files)
+    wav_path = output_path if output_path.suffix.lower() == '.wav' else output_path.with_name(output_path.name + '.wav.part')
+    metadata_path = output_path.with_name(output_path.name + '.ffmeta')
+    try:
+        cues, chapters, duration = write_track_items_wav(items, wav_path)
+        if wav_path != output_path:
+            write_ffmetadata(chapters, metadata_path, f"{sheet} {start_row}~{end_row}")
+            encode_lesson_audio(wav_path, metadata_path, output_path, args.bitrate)
+    finally:
+        if wav_path != output_path:
+            wav_path.unlink(missing_ok=True)
+        metadata_path.unlink(missing_ok=True)
+
+    if args.subtitle_mode == 'word':
+        subtitle_cues = word_phrase_cues([cue for cue in cues if cue['kind'] == 'speak'])
+    else:
+        subtitle_cues = [cue for cue in cues if cue['kind'] == 'subtitle']
+    subtitle_path = output_path.with_suffix('.srt')
+    with open(subtitle_path, 'w', encoding='utf-8') as f:
+        f.write(format_srt(subtitle_cues))
+    with open(output_path.with_suffix('.vtt'), 'w', encoding='utf-8') as f:
+        f.write(format_webvtt(subtitle_cues))
+    print(f"{output_path} ({duration / 60:.1f}분, 챕터 {len(chapters)}개), "
+          f"{subtitle_path.stem}.srt/.vtt - {time.time() - started:.1f}초")
+    return 0
+
+def latency_summary(values):
+    """소요 시간(초) 목록의 요약 - 개수, 평균, p50/p90/p99, 최대 (ms)"""
+    if not values:
+        return {'count': 0}
+    ms = np.array(values) * 1000
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {'count': len(values), 'mean_ms': round(float(ms.mean()), 2), 'p50_ms': round(float(p50), 2),
+            'p90_ms': round(float(p90), 2), 'p99_ms': round(float(p99), 2), 'max_ms': round(float(ms.max()), 2)}
+
+def sentence_transition_times(playback_timeline):
+    """문장 시작 이벤트부터 그 문장의 첫 음성 재생까지 걸린 시간(초) 목록"""
+    transitions = []
+    sentence_at = None
+    for event in playback_timeline:
+        if event['kind'] == 'sentence':
+            sentence_at = event['t']
+        elif event['kind'] == 'speak' and sentence_at is not None:
+            transitions.append(event['t'] - sentence_at)
+            sentence_at = None
+    return transitions
+
+async def run_lesson_benchmark(settings, lang_data, start_idx, time_scale=0.0):
+    """start_learning과 같은 흐름(계획 -> 타임라인 -> 미리 생성 -> 재생)을 화면 없이 실행하고 단계별 시간 측정"""
+    started = time.perf_counter()
+    plan = build_session_plan(settings, lang_data)
+    timeline = compile_lesson_timeline(plan, start_idx)
+    compile_seconds = time.perf_counter() - started
+
+    pipeline = create_prefetch_pipeline(plan, timeline)
+    scheduler = create_playback_scheduler(time_scale, timeline_limit=len(timeline.events))
+    playback = {'word_task': None}
+    progress, status = st.empty(), st.empty()
+    subtitles = [st.empty() for _ in range(3)]
+    try:
+        await render_lesson_timeline(timeline, plan, pipeline, scheduler, playback,
+                                     progress, status, subtitles, False)
+    finally:
+        cancel_prefetch(pipeline)
+    elapsed = time.perf_counter() - started
+    stats = pipeline['stats']
+    return {
+        'sentences': timeline.total * timeline.passes,
+        'events': len(timeline.events),
+        'clips': len(stats['clip']),
+        'elapsed_s': round(elapsed, 4),
+        'compile_ms': round(compile_seconds * 1000, 3),
+        'clips_per_s': round(len(stats['clip']) / elapsed, 2) if elapsed else None,
+        'stages': {
+            'synthesis': latency_summary(stats['clip']),
+            'stall': latency_summary(stats['stall']),
+            'track': latency_summary(stats['track']),
+            'transition': latency_summary(sentence_transition_times(scheduler['timeline']))
+        }
+    }
+
+def _quiet_streamlit_logs():
+    """streamlit run 없이 실행할 때 나오는 ScriptRunContext 경고 숨김
+
+    설정 파일을 처음 읽을 때 로그 수준이 다시 지정되므로 설정을 먼저 읽은 뒤 낮춤
+    """
+    from streamlit import logger as streamlit_logger
+    st.get_option('logger.level')
+    streamlit_logger.set_log_level('error')
+
+def print_bench_report(report):
+    """벤치마크 결과 요약 출력"""
+    print(f"워크북 로드 {report['workbook_load_ms']:.1f}ms, 시트 범위 로드 {report['sheet_load_ms']:.1f}ms")
+    for number, run in enumerate(report['runs'], start=1):
+        print(f"[{number}회차] {run['sentences']}문장 {run['clips']}클립 {run['elapsed_s']:.2f}초 "
+              f"({run['clips_per_s']} clips/s), 캐시 적중률 {run['cache']['hit_ratio']:.0%}")
+        for stage, summary in run['stages'].items():
+            if summary['count']:
+                print(f"  {stage:<10} n={summary['count']:<5} p50 {summary['p50_ms']:>8.2f}ms  "
+                      f"p90 {summary['p90_ms']:>8.2f}ms  p99 {summary['p99_ms']:>8.2f}ms")
+    if 'error' in report.get('export', {}):
+        print(f"WAV 인코딩 실패: {report['export']['error']}")
+    elif 'export' in report:
+        print(f"WAV 인코딩 {report['export']['encode_ms']:.1f}ms ({report['export']['duration_s']:.1f}초 분량)")
+    memory = report['memory']
+    print(f"메모리 최대 {memory['tracemalloc_peak_mb']:.1f}MB (tracemalloc), RSS {memory['rss_mb']:.1f}MB")
+
+def run_bench_cli(argv):
+    """명령줄: 테스트 TTS 엔진으로 학습 흐름 전체를 화면 없이 실행하여 성능 측정
+
+    python en600_st_pro.py bench --start-row 1 --end-row 50 --latency 0.2 --json bench.json
+    """
+    global TTS_BACKEND, TTS_CACHE_DIR, TTS_CACHE_META_DIR, TTS_CACHE_INDEX_PATH, FAKE_TTS_LATENCY
+    parser = argparse.ArgumentParser(prog='en600_st_pro.py bench', description='학습 파이프라인 벤치마크')
+    parser.add_argument('--sheet', help='시트 이름 또는 번호 (기본값: 저장된 설정)')
+    parser.add_argument('--user', help='설정을 불러올 사용자 ID (기본값: 공용 설정 파일)')
+    parser.add_argument('--start-row', type=int, default=1, help='시작 행 (1부터)')
+    parser.add_argument('--end-row', type=int, default=20, help='종료 행')
+    parser.add_argument('--backend', choices=list(TTS_BACKENDS), default='fake', help='음성 합성 엔진')
+    parser.add_argument('--latency', type=float, default=FAKE_TTS_LATENCY, help='테스트 엔진의 합성 지연(초)')
+    parser.add_argument('--runs', type=int, default=2, help='반복 실행 횟수 (첫 회는 빈 캐시, 이후는 캐시 적중)')
+    parser.add_argument('--time-scale', type=float, default=0.0, help='재생/대기 시간 배율 (0: 대기 없음, 1: 실제 시간)')
+    parser.add_argument('--track-mode', choices=['clips', 'sentence'], default='clips', help='재생 방식')
+    parser.add_argument('--cache-dir', help='클립 저장소 경로 (기본값: 빈 임시 폴더)')
+    parser.add_argument('--export', action='store_true', help='전체 학습 WAV 인코딩 시간도 측정')
+    parser.add_argument('--json', help="결과 JSON 저장 경로 ('-': 표준 출력)")
+    args = parser.parse_args(argv)
+
+    TTS_BACKEND = args.backend
+    FAKE_TTS_LATENCY = args.latency
+    cache_dir = Path(args.cache_dir) if args.cache_dir else Path(tempfile.mkdtemp(prefix='en600-bench-'))
+    TTS_CACHE_DIR, TTS_CACHE_META_DIR = cache_dir, cache_dir / 'meta'
+    TTS_CACHE_INDEX_PATH = TTS_CACHE_META_DIR / 'index.json'
+    tracemalloc.start()
+
+    settings = load_saved_settings(args.user)
+    # 화면 없이 끝까지 실행되도록 자동 반복/단어 강조는 끄고 재생 방식만 지정
+    settings.update(auto_repeat=False, subtitle_word_sync=False, audio_track_mode=args.track_mode)
+    st.session_state.settings = settings
+    st.session_state.last_update_time = time.time()
+    st.session_state.today_total_study_time = 0
+    sheet = args.sheet if args.sheet is not None else settings.get('selected_sheet', 0)
+    if isinstance(sheet, str) and sheet.isdigit():
+        sheet = int(sheet)
+
+    started = time.perf_counter()
+    _load_workbook.clear()
+    get_workbook()
+    workbook_load = time.perf_counter() - started
+    started = time.perf_counter()
+    languages = [settings[key] for key in ('first_lang', 'second_lang', 'third_lang') if settings.get(key, 'none') != 'none']
+    lang_data = load_sheet_range(sheet, languages, args.start_row - 1, args.end_row - 1)
+    sheet_load = time.perf_counter() - started
+
+    report = {
+        'version': 1,
+        'config': {'sheet': sheet, 'start_row': args.start_row, 'end_row': args.end_row, 'backend': args.backend,
+                   'latency': args.latency, 'time_scale': args.time_scale, 'track_mode': args.track_mode,
+                   'prefetch_depth': settings.get('prefetch_depth'), 'cache_dir': str(cache_dir)},
+        'workbook_load_ms': round(workbook_load * 1000, 2),
+        'sheet_load_ms': round(sheet_load * 1000, 2),
+        'runs': []
+    }
+    for _ in range(max(1, args.runs)):
+        before = dict(TTS_CACHE_STATS)
+        run = asyncio.run(run_lesson_benchmark(settings, lang_data, args.start_row - 1, args.time_scale))
+        hits = TTS_CACHE_STATS['hits'] - before['hits']
+        misses = TTS_CACHE_STATS['misses'] - before['misses']
+        run['cache'] = {'hits': hits, 'misses': misses, 'hit_ratio': hits / (hits + misses) if hits + misses else 0.0}
+        report['runs'].append(run)
+
+    if args.export:
+        timeline = compile_lesson_timeline(build_session_plan(settings, lang_data), args.start_row - 1)
+        audio_files, _ = asyncio.run(synthesize_lesson_clips(timeline))
+        wav_path = cache_dir / 'bench-export.wav'
+        started = time.perf_counter()
+        try:
+            _, _, duration = write_track_items_wav(lesson_export_items(timeline, settings, audio_files), wav_path)
+            report['export'] = {'encode_ms': round((time.perf_counter() - started) * 1000, 2), 'duration_s': round(duration, 2)}
+        except Exception as e:
+            # MP3 클립 디코딩에는 ffmpeg 필요
+            report['export'] = {'error': str(e)}
+        finally:
+            wav_path.unlink(missing_ok=True)
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report['memory'] = {'tracemalloc_peak_mb': round(peak / 1024 / 1024, 2),
+                        'rss_mb': round(sample_process_metrics()['rss_bytes'] / 1024 / 1024, 2)}
+    report['tts_client'] = dict(TTS_CLIENT_STATS)
+    report['hot_tier'] = get_clip_hot_tier_stats()
+    report['spans'] = get_span_metrics()
+
+    if args.json == '-':
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_bench_report(report)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    # 지연된 인덱스 기록을 임시 저장소를 지우기 전에 마침 (종료 시 없는 폴더에 쓰지 않도록)
+    flush_tts_cache_index()
+    if not args.cache_dir:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return 0
+
+def parse_import_times(stderr, module):
+    """python -X importtime 출력에서 module 전체 시간과 직접 불러온 모듈별 누적 시간(ms) 추출
+
+    이미 다른 모듈이 불러온 모듈은 처음 불러온 쪽에 포함됨
+    """
+    entries = []
+    for line in stderr.splitlines():
+        parts = line.split('|')
+        if not line.startswith('import time:') or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2][1:]
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        entries.append((depth, int(parts[1]) / 1000, name.strip()))
+    for i, (depth, total, name) in enumerate(entries):
+        if depth == 0 and name == module:
+            children = []
+            for child_depth, child_total, child_name in reversed(entries[:i]):
+                if child_depth == 0:
+                    break
+                if child_depth == 1:
+                    children.append((child_name, round(child_total, 1)))
+            return round(total, 1), sorted(children, key=lambda item: -item[1])
+    return None, []
+
+def measure_import_time(module, cwd=None):
+    """새 프로세스에서 module을 불러오는 시간 측정 - (전체 ms, [(모듈, ms)])"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=cwd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f'import {module} 실패')
+    return parse_import_times(result.stderr, module)
+
+def run_import_budget_cli(argv):
+    """명령줄: 앱 모듈 import 시간을 모듈별로 보고하고 허용 시간을 넘으면 실패 (종료 코드 1)
+
+    python en600_st_pro.py import-budget --budget-ms 2500 --runs 3
+    """
+    parser = argparse.ArgumentParser(prog='en600_st_pro.py import-budget', description='import 시간 점검')
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS, help='앱 모듈 import 허용 시간(ms)')
+    parser.add_argument('--runs', type=int, default=3, help='측정 횟수 (가장 빠른 값 사용)')
+    parser.add_argument('--top', type=int, default=15, help='표시할 모듈 수')
+    parser.add_argument('--json', help="결과 JSON 저장 경로 ('-': 표준 출력)")
+    args = parser.parse_args(argv)
+
+    module_path = Path(__file__).resolve()
+    measurements = [measure_import_time(module_path.stem, cwd=module_path.parent) for _ in range(max(1, args.runs))]
+    total, modules = min(measurements, key=lambda item: item[0])
+    deferred = {}
+    for name in LAZY_MODULES:
+        try:
+            deferred[name] = min(measure_import_time(name)[0] for _ in range(max(1, args.runs)))
+        except Exception as e:
+            deferred[name] = str(e)
+    report = {
+        'version': 1,
+        'module': module_path.stem,
+        'total_ms': total,
+        'budget_ms': args.budget_ms,
+        'within_budget': total <= args.budget_ms,
+        'modules': [{'name': name, 'ms': ms} for name, ms in modules],
+        'deferred': deferred
+    }
+
+    if args.json == '-':
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"{report['module']} import {total:.1f}ms (허용 {args.budget_ms:.0f}ms) - {'통과' if report['within_budget'] else '초과'}")
+        for name, ms in modules[:args.top]:
+            print(f"  {name:<24} {ms:>9.1f}ms {ms / total * 100 if total else 0:5.1f}%")
+        print("처음 사용할 때 불러오는 모듈:")
+        for name, ms in deferred.items():
+            print(f"  {name:<24} {ms:>9.1f}ms" if isinstance(ms, float) else f"  {name:<24} 불러오기 실패: {ms}")
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if report['within_budget'] else 1
+
+# 명령줄 하위 명령 (streamlit run 시에는 사용되지 않음)
+CLI_COMMANDS = {
+    'prerender': run_prerender_cli,
+    'build-sidecar': run_build_sidecar_cli,
+    'export': run_export_cli,
+    'bench': run_bench_cli,
+    'import-budget': run_import_budget_cli
+}
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        _quiet_streamlit_logs()
+        sys.exit(CLI_COMMANDS[sys.argv[1]](sys.argv[2:]))
     main()